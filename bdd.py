@@ -0,0 +1,220 @@
+"""
+Reduced ordered binary decision diagrams, compiled from boolean
+constraints (anything with .variables in sorted order and a .values
+table of allowed tuples, like boolean_constraints.BC). Once compiled,
+counting, listing, and checking partial assignments against the
+allowed configurations take time in proportion to the diagram.
+"""
+
+import heapq, operator
+
+false, true = 0, 1              # The terminal nodes.
+
+class Diagram(object):
+    """A BDD for the conjunction of some constraints. Nodes are ints
+    indexing self.levels, self.lows, and self.highs; a node at level
+    i tests variable self.order[i], going to low if it's false, else
+    high. Nodes are hash-consed, so equal functions are equal ints;
+    and a node's children come before it. (So the methods walking
+    the diagram can go in order of node instead of recursing, which
+    would overflow Python's stack on big networks.)"""
+    def __init__(self, constraints, order=None):
+        constraints = list(constraints)
+        if order is None: order = choose_order(constraints)
+        self.order = order
+        self.level_of = {v: i for i, v in enumerate(self.order)}
+        n = len(self.order)
+        self.levels = [n, n]    # The terminals come after every variable.
+        self.lows = [None, None]
+        self.highs = [None, None]
+        self.unique = {}        # (level, low, high) -> node
+        self.computed = {}      # (op, node, node) -> node
+        root = true
+        # Conjoin from the constraints with the last first variables,
+        # so the diagram grows from the bottom up: then each apply
+        # stops about where the new constraint's variables do, rather
+        # than going through all of the diagram so far.
+        constraints.sort(key=lambda constraint: -min(
+            self.level_of[v] for v in constraint.variables))
+        for constraint in constraints:
+            root = self.apply(operator.and_, root, self.table(constraint))
+        for v in self.order:
+            if v.value is not None:
+                root = self.apply(operator.and_, root,
+                                  self.literal(v, v.value))
+        self.root = root
+        self.computed.clear()
+    def make(self, level, low, high):
+        "Return the node testing level, hash-consed and reduced."
+        if low == high:
+            return low
+        key = level, low, high
+        node = self.unique.get(key)
+        if node is None:
+            node = self.unique[key] = len(self.levels)
+            self.levels.append(level)
+            self.lows.append(low)
+            self.highs.append(high)
+        return node
+    def literal(self, v, value):
+        level = self.level_of[v]
+        return (self.make(level, false, true) if value
+                else self.make(level, true, false))
+    def table(self, constraint):
+        """Return the node for constraint's table of allowed tuples.
+        (This recurses as deep as the constraint has variables, which
+        the size of its table keeps few.)"""
+        indexed = sorted((self.level_of[v], i)
+                         for i, v in enumerate(constraint.variables))
+        def build(k, tuples):
+            if not tuples:
+                return false
+            if k == len(indexed):
+                return true
+            level, i = indexed[k]
+            return self.make(level,
+                             build(k+1, [t for t in tuples if not t[i]]),
+                             build(k+1, [t for t in tuples if t[i]]))
+        return build(0, list(constraint.values))
+    def apply(self, op, u, v):
+        """Return the node for op(u, v), op being a commutative
+        function on 0 and 1, like operator.and_."""
+        results = []            # Nodes made, awaiting their parents.
+        pending = [(u, v, False)] # (u, v, whether to build from results)
+        while pending:
+            u, v, build = pending.pop()
+            key = (op, u, v) if u < v else (op, v, u)
+            if build:
+                high, low = results.pop(), results.pop()
+                level = min(self.levels[u], self.levels[v])
+                results.append(self.make(level, low, high))
+                self.computed[key] = results[-1]
+                continue
+            node = self.shortcut(op, u, v)
+            if node is None:
+                node = self.computed.get(key)
+            if node is not None:
+                results.append(node)
+                continue
+            level = min(self.levels[u], self.levels[v])
+            u0, u1 = self.cofactors(u, level)
+            v0, v1 = self.cofactors(v, level)
+            pending.extend([(u, v, True), (u1, v1, False), (u0, v0, False)])
+        return results[0]
+    def shortcut(self, op, u, v):
+        "Return op(u, v) if it's immediate, else None."
+        if u <= true and v <= true:
+            return int(op(u, v))
+        if op is operator.and_:
+            if u == false or v == false: return false
+            if u == true or u == v: return v
+            if v == true: return u
+        return None
+    def cofactors(self, u, level):
+        if self.levels[u] == level:
+            return self.lows[u], self.highs[u]
+        return u, u
+    def reachable(self):
+        "The nodes reachable from the root, terminals included, in order."
+        seen = set()
+        pending = [self.root]
+        while pending:
+            u = pending.pop()
+            if u in seen: continue
+            seen.add(u)
+            if true < u:
+                pending.extend((self.lows[u], self.highs[u]))
+        return sorted(seen)
+    def size(self):
+        "The number of nodes reachable from the root, terminals included."
+        return len(self.reachable())
+    def count(self, given=None):
+        """Return how many assignments to all of self.order satisfy
+        the constraints (and agree with the dict given, if any)."""
+        given = {self.level_of[v]: value
+                 for v, value in (given or {}).iteritems()}
+        n = len(self.order)
+        free_below = [0] * (n + 1) # free_below[i]: levels >= i not given
+        for i in range(n-1, -1, -1):
+            free_below[i] = free_below[i+1] + (i not in given)
+        def skipped(level, u):
+            "How many ways to assign the free levels from level to u's."
+            return 2 ** (free_below[level] - free_below[self.levels[u]])
+        paths = {false: 0, true: 1} # node -> how many assignments to
+                                    # the levels >= its own lead to true
+        for u in self.reachable():
+            if u <= true: continue
+            level = self.levels[u]
+            total = 0
+            for value, child in ((False, self.lows[u]),
+                                 (True, self.highs[u])):
+                if given.get(level, value) == value:
+                    total += paths[child] * skipped(level+1, child)
+            paths[u] = total
+        return paths[self.root] * skipped(0, self.root)
+    def models(self):
+        "Generate each satisfying assignment to self.order, as a dict."
+        n = len(self.order)
+        asgn = []               # The values for levels 0, 1, ...
+        pending = [(self.root, 0, None)] # (node, level, value for level-1)
+        while pending:
+            u, level, value = pending.pop()
+            if value is not None:
+                del asgn[level-1:]
+                asgn.append(value)
+            if u == false:
+                continue
+            if level == n:
+                yield dict(zip(self.order, asgn))
+                continue
+            for value in (True, False): # (So False comes off first.)
+                if self.levels[u] == level:
+                    child = self.highs[u] if value else self.lows[u]
+                else:
+                    child = u   # A don't-care level: both values do.
+                pending.append((child, level+1, value))
+    def satisfiable(self, given):
+        "Can the dict given extend to a satisfying assignment?"
+        given = {self.level_of[v]: value for v, value in given.iteritems()}
+        sat = {false: False, true: True}
+        for u in self.reachable():
+            if u <= true: continue
+            value = given.get(self.levels[u])
+            sat[u] = (sat[self.highs[u] if value else self.lows[u]]
+                      if value is not None
+                      else sat[self.lows[u]] or sat[self.highs[u]])
+        return sat[self.root]
+
+def choose_order(constraints):
+    """Order the variables so constraints' variables come close
+    together: repeatedly take the constraint sharing the most
+    variables with those placed already (then the one adding fewest
+    new ones, then the earliest), and place its new variables."""
+    constraints = list(constraints)
+    users = {}                  # variable -> indices of its constraints
+    for i, constraint in enumerate(constraints):
+        for v in constraint.variables:
+            users.setdefault(v, []).append(i)
+    shared = [0] * len(constraints)
+    def score(i):
+        return (-shared[i], len(constraints[i].variables) - shared[i], i)
+    # A heap of scores, some out of date: placing variables only
+    # improves scores, so an entry that's out of date comes off after
+    # the current one, and gets skipped.
+    heap = map(score, range(len(constraints)))
+    heapq.heapify(heap)
+    placed, order, done = set(), [], set()
+    while heap:
+        entry = heapq.heappop(heap)
+        i = entry[-1]
+        if i in done or entry != score(i): continue
+        done.add(i)
+        for v in constraints[i].variables:
+            if v not in placed:
+                placed.add(v)
+                order.append(v)
+                for j in users[v]:
+                    if j not in done:
+                        shared[j] += 1
+                        heapq.heappush(heap, score(j))
+    return order
@@ -0,0 +1,258 @@
+"""
+Time the pipeline on synthetic figures of growing size.
+
+    python bench.py                       # Print results as JSON.
+    python bench.py -o new.json           # Save them instead.
+    python bench.py --baseline old.json   # Also compare with old results.
+
+Each case is a generator of Linogram source, run through parse,
+instantiate, solve, and draw; or of a figure built with the Python
+API (linear_constraints directly), which has no parse phase.
+"""
+
+import argparse, gc, json, sys, time
+import interpreter, linear_constraints as LC, linear_equations, parser
+
+library = """
+define point { number x, y; }
+define line { point start, end; draw { &draw_line; } }
+define hline extends line {
+    number y, len;
+    constraints { start.y = y; end.y = y; end.x = start.x + len; }
+}
+define vline extends line {
+    number x, len;
+    constraints { start.x = x; end.x = x; end.y = start.y + len; }
+}
+define box {
+    hline top, bottom;
+    vline left, right;
+    point nw, c;
+    number ht, wd;
+    constraints {
+        nw = top.start; nw = left.start;
+        top.end = right.start; left.end = bottom.start;
+        bottom.end = right.end;
+        ht = left.len; wd = top.len;
+        c = (nw + bottom.end) / 2;
+    }
+    draw { top; bottom; left; right; }
+}
+"""
+
+def grid(n):
+    "An n by n grid of boxes, each placed relative to a neighbor."
+    lines = [library]
+    for i in range(n):
+        for j in range(n):
+            lines.append('box b%d_%d(ht = 1, wd = 1);' % (i, j))
+    lines.append('constraints {')
+    lines.append('    b0_0.nw = (0, 0);')
+    for i in range(n):
+        if i: lines.append('    b%d_0.nw = b%d_0.nw + (0, 2);' % (i, i-1))
+        for j in range(1, n):
+            lines.append('    b%d_%d.nw = b%d_%d.nw + (2, 0);'
+                         % (i, j, i, j-1))
+    lines.append('}')
+    return '\n'.join(lines)
+
+def array_grid(n):
+    "Like grid, but an array of boxes placed by constraint loops."
+    lines = [library, 'box b[%d](ht = 1, wd = 1);' % (n*n),
+             'constraints { b[0].nw = (0, 0); }']
+    if 1 < n:
+        lines.append('constraints for i = 1 to %d'
+                     ' { b[i*%d].nw = b[i*%d - %d].nw + (0, 2); }'
+                     % (n-1, n, n, n))
+        for i in range(n):
+            lines.append('constraints for j = %d to %d'
+                         ' { b[j].nw = b[j-1].nw + (2, 0); }'
+                         % (i*n + 1, i*n + n-1))
+    return '\n'.join(lines)
+
+def chain(n):
+    "A staircase of n lines, each starting where the last one ends."
+    lines = [library, 'hline l0(len = 1);',
+             'constraints { l0.start = (0, 0); }']
+    for i in range(1, n):
+        lines.append('%s l%d(len = 1);' % ('vline' if i % 2 else 'hline', i))
+        lines.append('constraints { l%d.start = l%d.end; }' % (i, i-1))
+    return '\n'.join(lines)
+
+def hierarchy(depth, copies=10):
+    "A tower of definitions, each extending the last, and copies of the top."
+    lines = ['define level0 { number a0; }']
+    for k in range(1, depth+1):
+        lines.append('define level%d extends level%d {' % (k, k-1))
+        lines.append('    number a%d;' % k)
+        lines.append('    constraints { a%d = a%d + 1; }' % (k, k-1))
+        lines.append('}')
+    for i in range(copies):
+        lines.append('level%d x%d;' % (depth, i))
+        lines.append('constraints { x%d.a0 = %d; }' % (i, i))
+    return '\n'.join(lines)
+
+def api_chain(n):
+    "Like chain, through the Python API: n points each offset from the last."
+    points = [point() for _ in range(n)]
+    points[0] ^ LC.Compound(dict(x=0, y=0))
+    for p, q in zip(points, points[1:]):
+        q ^ p + LC.Compound(dict(x=1, y=1))
+    return points
+
+def api_grid(n):
+    "Like grid, through the Python API, with points for boxes."
+    rows = [[point() for _ in range(n)] for _ in range(n)]
+    rows[0][0] ^ LC.Compound(dict(x=0, y=0))
+    for i, row in enumerate(rows):
+        if i: row[0] ^ rows[i-1][0] + LC.Compound(dict(x=0, y=2))
+        for p, q in zip(row, row[1:]):
+            q ^ p + LC.Compound(dict(x=2, y=0))
+    return [p for row in rows for p in row]
+
+def point():
+    return LC.Compound(dict(x=LC.Number(), y=LC.Number()))
+
+# name -> (kind, generator, sizes, quick sizes)
+cases = dict(grid       = ('lino', grid,       [5, 10, 20],       [3, 5]),
+             array_grid = ('lino', array_grid, [5, 10, 20],       [3, 5]),
+             chain      = ('lino', chain,      [100, 300, 1000],  [30, 100]),
+             hierarchy  = ('lino', hierarchy,  [10, 50, 200],     [5, 20]),
+             api_chain  = ('api',  api_chain,  [100, 1000, 5000], [30, 300]),
+             api_grid   = ('api',  api_grid,   [10, 30, 60],      [5, 10]))
+
+phases = ('parse', 'instantiate', 'solve', 'draw')
+
+def time_lino(source):
+    """Return the times of each phase of running source, and how many
+    constraints it posted. The phases go as in interpreter.run, with
+    solving taking in making the table of values and freezing."""
+    times = {}
+    start = time.time()
+    program = parser.parse(source)
+    times['parse'], start = time.time() - start, time.time()
+    env, inst, constraints = interpreter.instantiate(program)
+    times['instantiate'], start = time.time() - start, time.time()
+    LC.solve_all(constraints)
+    table = LC.ValueTable(interpreter.variables_of(inst))
+    LC.freeze(constraints)
+    times['solve'], start = time.time() - start, time.time()
+    interpreter.draw(inst, env, table)
+    env.canvas.to_string()
+    times['draw'] = time.time() - start
+    return times, len(constraints)
+
+def time_api(make, size):
+    "Like time_lino, for an API figure (where drawing is getting values)."
+    times = dict(parse=0.)
+    start = time.time()
+    points, constraints = LC.collect(lambda: make(size))
+    times['instantiate'], start = time.time() - start, time.time()
+    LC.solve_all(constraints)
+    times['solve'], start = time.time() - start, time.time()
+    [(p.x.get_value(), p.y.get_value()) for p in points]
+    times['draw'] = time.time() - start
+    return times, len(constraints)
+
+def run_case(name, size, repeat):
+    "Return a result record for case name at size: the best of repeat runs."
+    kind, make, _, _ = cases[name]
+    source = make(size) if kind == 'lino' else None
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        if kind == 'lino':
+            times, n_constraints = time_lino(source)
+        else:
+            times, n_constraints = time_api(make, size)
+        times['total'] = sum(times[phase] for phase in phases)
+        if best is None or times['total'] < best['total']:
+            best = times
+    return dict(best, case=name, size=size, constraints=n_constraints)
+
+def main(argv):
+    argparser = argparse.ArgumentParser(prog=argv[0],
+                                        description="Benchmark minilinogram.")
+    argparser.add_argument('names', nargs='*', metavar='CASE',
+                           help="cases to run (default all): %s"
+                                % ', '.join(sorted(cases)))
+    argparser.add_argument('-o', '--output', default='-',
+                           help="JSON file to write (default stdout)")
+    argparser.add_argument('--baseline', metavar='FILE',
+                           help="earlier JSON output to compare with")
+    argparser.add_argument('--tolerance', type=float, default=0.25,
+                           help="slowdown in total time, as a fraction,"
+                                " to count as a regression"
+                                " (default %(default)s)")
+    argparser.add_argument('--quick', action='store_true',
+                           help="run just the small sizes")
+    argparser.add_argument('--repeat', type=int, default=3,
+                           help="runs per size, keeping the fastest"
+                                " (default %(default)s)")
+    argparser.add_argument('--solver', default=LC.backend,
+                           choices=sorted(linear_equations.backends))
+    argparser.add_argument('--lin-exps', default='dict',
+                           choices=sorted(linear_equations.lin_exp_kinds))
+    options = argparser.parse_args(argv[1:])
+    names = options.names or sorted(cases)
+    for name in names:
+        if name not in cases:
+            argparser.error("Unknown case: %r" % name)
+    LC.use_backend(options.solver)
+    LC.use_lin_exps(options.lin_exps)
+
+    results = []
+    for name in names:
+        _, _, sizes, quick_sizes = cases[name]
+        for size in (quick_sizes if options.quick else sizes):
+            result = run_case(name, size, options.repeat)
+            sys.stderr.write('%-10s %5d  %s\n'
+                             % (name, size, format_times(result)))
+            results.append(result)
+    report = dict(python=sys.version.split()[0],
+                  solver=options.solver, lin_exps=options.lin_exps,
+                  results=results)
+    text = json.dumps(report, indent=1, separators=(',', ': '),
+                      sort_keys=True) + '\n'
+    if options.output == '-':
+        sys.stdout.write(text)
+    else:
+        with open(options.output, 'w') as f:
+            f.write(text)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        return compare(baseline['results'], results, options.tolerance)
+    return 0
+
+def format_times(result):
+    return '  '.join('%s %.4fs' % (phase, result[phase])
+                     for phase in phases + ('total',))
+
+def compare(old_results, new_results, tolerance):
+    """Print how the new results' times compare with the old, for the
+    cases and sizes in both. Return 1 if any total regressed by more
+    than tolerance, else 0."""
+    old = {(r['case'], r['size']): r for r in old_results}
+    regressions = 0
+    sys.stderr.write('\n%-10s %5s  %s\n' % ('case', 'size', '  '.join(
+        '%11s' % phase for phase in phases + ('total',))))
+    for new in new_results:
+        key = (new['case'], new['size'])
+        if key not in old: continue
+        ratios = [ratio(old[key][phase], new[phase])
+                  for phase in phases + ('total',)]
+        regressed = 1 + tolerance < ratios[-1]
+        regressions += regressed
+        sys.stderr.write('%-10s %5d  %s%s\n'
+                         % (key + ('  '.join('%10.2fx' % r for r in ratios),
+                                   '  REGRESSED' if regressed else '')))
+    return 1 if regressions else 0
+
+def ratio(old, new):
+    "How many times slower new is than old."
+    return new / old if old else 1.
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1,41 +1,159 @@
 """
-Trivial implementation of Boolean constraints. The main constraints
-module is supposed to be usable for many kinds of constraint networks,
-not just the linear equations used by linogram -- so let's try out
-defining another kind.
-XXX untested
+Boolean constraints. The main constraints module is supposed to be
+usable for many kinds of constraint networks, not just the linear
+equations used by linogram -- so let's try out defining another kind.
+
+A constraint is a table of the tuples of values its variables may
+take. We solve a network of them by DPLL-style search: propagate
+what the tables force, split what's left into independent parts,
+and in each part guess a variable and backtrack on failure.
 """
 
+from itertools import product
+
 from constraints import *
+import bdd
 
 class BC(Constraint):
     def __init__(self, variables, values):
         # values is a collection of tuples, each with a boolean for
         # each variable, corresponding to the variables in sorted
         # order.
-        self.variables = frozenset(variables)
+        self.variables = tuple(sorted(set(variables)))
         self.values = frozenset(values)
+        self.connect()
     def solve(self):
-        for variable, value in solve(self.connected_constraints()):
-            variable.assign(value)
+        for variable, value in solve(self.get_connected_constraints()):
+            if variable.value is None:
+                variable.assign(value)
+    def compile(self):
+        "Return a bdd.Diagram for the constraints connected to me."
+        return bdd.Diagram(self.get_connected_constraints())
     def get_variables(self):
         return self.variables
     def allows(self, asgn):
-        t = tuple(val for v, val in asgn if v in self.variables)
-        return t in self.values
+        "Given a dict from my variables to values, are they allowed?"
+        return tuple(asgn[v] for v in self.variables) in self.values
+    def live(self, asgn):
+        "Return my allowed tuples that agree with the partial assignment."
+        return [t for t in self.values
+                if all(asgn.get(v, x) == x
+                       for v, x in zip(self.variables, t))]
+
+def relate(variables, predicate):
+    """Make a BC allowing the values of variables (in the order given)
+    for which predicate(*values) is true."""
+    order = sorted(range(len(variables)), key=lambda i: variables[i])
+    return BC(variables,
+              [tuple(values[i] for i in order)
+               for values in product((False, True), repeat=len(variables))
+               if predicate(*values)])
 
 def solve(bcs):
-    vars = set().union(*[bc.variables for bc in bcs])
-    for asgn in assignments(sorted(vars)):
-        if all(bc.allows(asgn)):
-            return asgn.items()
-    return ()
-
-def assignments(vars):
-    if not vars:
-        yield ()
-    else:
-        v = vars[0]
-        for asgn in assignments(vars[1:]):
-            yield ((v, False),) + asgn
-            yield ((v, True),) + asgn
+    """Return a list of (variable, value) pairs satisfying all of
+    bcs, or () if there's none. Variables that already have a value
+    keep it."""
+    bcs = list(bcs)
+    users = {}                  # variable -> the bcs that have it
+    for bc in bcs:
+        for v in bc.variables:
+            users.setdefault(v, []).append(bc)
+    asgn = {v: v.value for v in users if v.value is not None}
+    asgn = search(bcs, asgn, users, bcs)
+    return () if asgn is None else sorted(asgn.items())
+
+def search(bcs, asgn, users, pending):
+    """Extend asgn to satisfy bcs, returning a new dict, or None if
+    it can't be. Only the pending bcs may not yet be propagated."""
+    asgn = propagate(pending, dict(asgn), users)
+    if asgn is None:
+        return None
+    for part in split([bc for bc in bcs
+                       if any(v not in asgn for v in bc.variables)],
+                      asgn):
+        asgn = guess(part, asgn, users)
+        if asgn is None:
+            return None
+    return asgn
+
+def propagate(pending, asgn, users):
+    """Assign in place each variable whose value the live tuples of a
+    constraint agree on, starting from the pending constraints, until
+    there's no more to do. Return asgn, or None on finding a
+    constraint with no live tuples."""
+    pending = list(pending)
+    while pending:
+        bc = pending.pop()
+        live = bc.live(asgn)
+        if not live:
+            return None
+        for i, v in enumerate(bc.variables):
+            if v in asgn: continue
+            value = live[0][i]
+            if all(t[i] == value for t in live):
+                asgn[v] = value
+                pending.extend(users[v])
+    return asgn
+
+def split(bcs, asgn):
+    "Group bcs into lists sharing no unassigned variables."
+    parts, part_of = [], {}     # part_of: unassigned variable -> its part
+    for bc in bcs:
+        free = [v for v in bc.variables if v not in asgn]
+        merging = []
+        for v in free:
+            part = part_of.get(v)
+            if part is not None and all(part is not p for p in merging):
+                merging.append(part)
+        if merging:
+            part = merging[0]
+            for other in merging[1:]:
+                part.extend(other)
+                parts[:] = [p for p in parts if p is not other]
+                for b in other:
+                    for v in b.variables:
+                        if v not in asgn: part_of[v] = part
+        else:
+            part = []
+            parts.append(part)
+        part.append(bc)
+        for v in free:
+            part_of[v] = part
+    return parts
+
+def guess(bcs, asgn, users):
+    """Search by choosing a value for the free variable appearing most
+    often among the tightest constraints -- those allowing the smallest
+    fraction of their free variables' combinations, so likeliest to
+    fail. Try first the value most of their live tuples give it."""
+    scored = []                 # (tightness, live tuples, bc)
+    for bc in bcs:
+        live = bc.live(asgn)
+        free = sum(v not in asgn for v in bc.variables)
+        scored.append((len(live) / 2.**free, live, bc))
+    least = min(tightness for tightness, _, _ in scored)
+    if least == 1:
+        # Nothing rules out any combination of what's left.
+        asgn = dict(asgn)
+        for bc in bcs:
+            for v in bc.variables:
+                asgn.setdefault(v, False)
+        return asgn
+    tally = {}                  # variable -> [occurrences, trues, tuples]
+    for tightness, live, bc in scored:
+        if tightness != least: continue
+        for i, v in enumerate(bc.variables):
+            if v in asgn: continue
+            counts = tally.setdefault(v, [0, 0, 0])
+            counts[0] += 1
+            counts[1] += sum(1 for t in live if t[i])
+            counts[2] += len(live)
+    v = max(tally, key=lambda v: (tally[v][0], -v.id))
+    _, trues, tuples = tally[v]
+    for value in ((True, False) if tuples <= 2*trues else (False, True)):
+        trial = dict(asgn)
+        trial[v] = value
+        result = search(bcs, trial, users, users[v])
+        if result is not None:
+            return result
+    return None
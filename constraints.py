@@ -1,12 +1,20 @@
 """
 A variable may have a value; a constraint enforces a relation
 between variables. Variables and constraints form a network.
+We track the network's connected components with union-find as
+constraints get added, so finding a component takes no graph walk.
 """
 
+import itertools
+
+variable_ids = itertools.count()
+
 class Variable(object):
     def __init__(self):
+        self.id = next(variable_ids) # Dense, and ordered by creation.
         self.constraints = set()
         self.value = None
+        self.component = None   # Some Component node; find() for the root.
     def constrain(self, constraint):
         if self.value is None:
             self.constraints.add(constraint)
@@ -16,24 +24,58 @@ class Variable(object):
     def solve(self):
         assert self.constraints, "Unconstrained: %r" % self
         next(iter(self.constraints)).solve() # XXX solve them all?
-    def add_connected_constraints(self, constraints):
-        for constraint in self.constraints:
-            constraint.add_connected_constraints(constraints)
+    def get_component(self):
+        return self.component.find()
     def assign(self, value):
         assert self.value is None or self.value == value
         self.value = value
+    def __lt__(self, other):
+        return self.id < other.id
+
+class Component(object):
+    "A union-find node for a connected set of constraints."
+    def __init__(self, constraints):
+        self.parent = self
+        self.constraints = constraints # (Meaningful only at a root.)
+    def find(self):
+        root = self
+        while root.parent is not root:
+            root = root.parent
+        node = self
+        while node is not root:
+            node.parent, node = root, node.parent
+        return root
+    def union(self, other):
+        "Merge our components; return the root of the result."
+        root, other = self.find(), other.find()
+        if root is other: return root
+        if len(root.constraints) < len(other.constraints):
+            root, other = other, root
+        other.parent = root
+        root.absorb(other)
+        return root
+    def absorb(self, other):
+        "Take on the contents of other, which is joining my component."
+        self.constraints.extend(other.constraints)
+        other.constraints = None
 
 class Constraint(object):
+    component_class = Component
+    def connect(self):
+        "Join the network: merge my variables' components, plus me."
+        component = self.component_class([self])
+        for variable in self.get_variables():
+            variable.constrain(self)
+            if variable.component is None:
+                variable.component = component
+            else:
+                component = component.union(variable.component)
+        self.component = component
     def solve(self):
         abstract
     def get_variables(self):
         abstract
+    def get_component(self):
+        return self.component.find()
     def get_connected_constraints(self):
-        constraints = set()
-        self.add_connected_constraints(constraints)
-        return constraints
-    def add_connected_constraints(self, constraints):
-        if self in constraints: return
-        constraints.add(self)
-        for variable in self.get_variables():
-            variable.add_connected_constraints(constraints)
+        return self.get_component().constraints
@@ -0,0 +1,89 @@
+"""
+Count and time what the interpreter does, when asked to.
+
+    import instrument
+    instrument.enable()
+    ... run something ...
+    print instrument.format_report(instrument.report())
+
+The hooks elsewhere look at `enabled` before doing any work, so they
+cost next to nothing while it's off.
+"""
+
+import gc, time
+
+enabled = False
+times = {}                      # phase name -> total seconds
+counts = {}                     # counter name -> total
+peaks = {}                      # counter name -> greatest value seen
+
+def enable():
+    "Start counting, from zero."
+    global enabled
+    reset()
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    times.clear()
+    counts.clear()
+    peaks.clear()
+
+def count(name, n=1):
+    counts[name] = counts.get(name, 0) + n
+
+def peak(name, value):
+    if peaks.get(name, value) <= value:
+        peaks[name] = value
+
+def note_objects(name):
+    """Note how many objects the garbage collector tracks now, as a
+    peak of name: a measure of memory in use that goes down when
+    objects are freed (unlike the process's size, which CPython
+    seldom gives back)."""
+    peak(name, len(gc.get_objects()))
+
+def timing(phase):
+    "A context manager adding the time spent within it to phase's total."
+    return Timer(phase) if enabled else no_timer
+
+class Timer(object):
+    def __init__(self, phase):
+        self.phase = phase
+    def __enter__(self):
+        self.start = time.time()
+    def __exit__(self, *exc_info):
+        times[self.phase] = (times.get(self.phase, 0.)
+                             + time.time() - self.start)
+
+class NoTimer(object):
+    def __enter__(self):
+        pass
+    def __exit__(self, *exc_info):
+        pass
+
+no_timer = NoTimer()
+
+def report():
+    "Return a copy of what's been counted so far, as plain dicts."
+    return dict(times=dict(times), counts=dict(counts), peaks=dict(peaks))
+
+# The phases in order, for reporting; any others come after.
+phase_order = ('parse', 'instantiate', 'solve', 'freeze', 'draw', 'write')
+
+def format_report(report):
+    lines = []
+    phases = sorted(report['times'],
+                    key=lambda phase: (phase not in phase_order,
+                                       phase_order.index(phase)
+                                       if phase in phase_order else phase))
+    for phase in phases:
+        lines.append('%-24s %9.4fs' % (phase, report['times'][phase]))
+    for name in sorted(report['counts']):
+        lines.append('%-24s %9d' % (name, report['counts'][name]))
+    for name in sorted(report['peaks']):
+        lines.append('%-24s %9d' % ('max ' + name, report['peaks'][name]))
+    return '\n'.join(lines) + '\n'
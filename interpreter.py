@@ -4,24 +4,73 @@ Abstract syntax and its interpreter.
 
 import operator
 
-from structs import Struct
+from structs import Struct, as_sexpr
+import instrument
 import linear_constraints as LC
-
-def run(program):
-    types = {'number': NumberType()}
-    env = Environment(types, None)
+import svg
+
+def run(program, canvas=None, types=None, solutions=None):
+    """Draw program onto canvas (by default a new one); return the canvas.
+    To rerun an edited program faster, pass the same types dict
+    (emptied here) and solutions dict (see LC.solve_all) each time:
+    then the Definitions carried over keep their templates, unless
+    invalidate() says not to."""
+    with instrument.timing('instantiate'):
+        env, inst, constraints = instantiate(program, canvas, types)
+    with instrument.timing('solve'):
+        LC.solve_all(constraints, solutions)
+        table = LC.ValueTable(variables_of(inst))
+    with instrument.timing('freeze'):
+        if instrument.enabled: instrument.note_objects('objects before freeze')
+        LC.freeze(constraints)
+        constraints = None      # (Our last reference to them.)
+        if instrument.enabled: instrument.note_objects('objects after freeze')
+    with instrument.timing('draw'):
+        draw(inst, env, table)
+    return env.canvas
+
+def instantiate(program, canvas=None, types=None):
+    """The first phase of run: return the environment, the program's
+    instance, and the constraints instantiating posted."""
+    if canvas is None: canvas = svg.Canvas()
+    if types is None: types = {}
+    types.clear()
+    types['number'] = NumberType()
+    env = Environment(types, None, canvas, None)
     main = Definition('<program>', None, program)
-    inst = main.instantiate(env)
-    inst.draw(env)
-
-
-class Environment(Struct('types inst')):
+    inst, constraints = LC.collect(lambda: main.instantiate(env))
+    # main won't be stamped again, and its template's shape of the
+    # whole figure refers back to it, a cycle to keep from leaving:
+    main.template = None
+    return env, inst, constraints
+
+solved = None                   # An LC.ValueTable, while drawing.
+
+def draw(inst, env, table):
+    "Draw inst, taking the values of its numbers from table."
+    global solved
+    saved, solved = solved, table
+    try:
+        inst.draw(env)
+    finally:
+        solved = saved
+
+
+class Environment(Struct('types inst canvas indices')):
+    __slots__ = ()              # indices: None, or dict of loop indices
     def spawn(self, inst):
-        return Environment(self.types, inst)
+        return Environment(self.types, inst, self.canvas, None)
+    def bind(self, id, value):
+        "Return me with loop index id set to the number value."
+        indices = dict(self.indices or {})
+        indices[id] = value
+        return Environment(self.types, self.inst, self.canvas, indices)
     def init(self, id, value):
         assert id not in self.inst.mapping, "Multiple def: %s" % id
         self.inst.mapping[id] = value
     def fetch(self, id):
+        if self.indices and id in self.indices:
+            return self.indices[id]
         assert id in self.inst.mapping, \
             "Not found: %r in %r" % (id, self.inst)
         return self.inst.mapping[id]
@@ -29,10 +78,16 @@ class Environment(Struct('types inst')):
 class NumberType(object):
     def instantiate(self, env):
         return NumberInstance()
+    def instantiate_many(self, env, count):
+        return [NumberInstance() for _ in xrange(count)]
 
 class NumberInstance(LC.Number):
     def draw(self, env):
         pass
+    def get_value(self):
+        if solved is not None:
+            return solved.get(self.lin_exp.a_variable())
+        return LC.Number.get_value(self)
 
 class Instance(LC.Compound):
     def __init__(self, type_):
@@ -44,22 +99,70 @@ class Instance(LC.Compound):
         return '<instance of %r: %r>' % (self.type, sorted(self.keys()))
 
 class TupleType(Struct('fields')):
+    __slots__ = ()
     def instantiate(self, env):
         inst = Instance(self)
         for f in self.fields:
             inst.mapping[f] = NumberInstance()
         return inst
+    def instantiate_many(self, env, count):
+        return [self.instantiate(env) for _ in xrange(count)]
     def draw(self, env):
         pass
 
+class ArrayType(Struct('element_type size')):
+    "An array's elements are its parts, keyed 0 to size-1."
+    __slots__ = ()
+    def instantiate(self, env):
+        inst = Instance(self)
+        elements = self.element_type.instantiate_many(env, self.size)
+        for k, element in enumerate(elements):
+            inst.mapping[k] = element
+        return inst
+    def instantiate_many(self, env, count):
+        return [self.instantiate(env) for _ in xrange(count)]
+    def draw(self, env):
+        for k in xrange(self.size):
+            env.inst.mapping[k].draw(env)
+
 class Definition(Struct('id extends decls')):
+    __slots__ = ('template',)   # Compiled on first instantiation.
     def build(self, env):
         env.types[self.id] = self
     def instantiate(self, env):
+        template = self.get_template(env)
+        if template is not None:
+            if instrument.enabled: instrument.count('templates stamped')
+            return template.stamp()
+        if instrument.enabled: instrument.count('templates compiled')
+        # The first time, instantiate by walking the decls, and save
+        # what happened as a template for next time.
         inst = Instance(self)
         subenv = env.spawn(inst) # XXX won't see global vars; should it?
-        self.populate(subenv)
+        lin_exps = LC.record(lambda: self.populate(subenv))
+        self.template = Template(env.types, inst, lin_exps,
+                                 self.pick_drawers(env))
+        for lin_exp in lin_exps:
+            LC.post(lin_exp)
         return inst
+    def instantiate_many(self, env, count):
+        "Make count instances, all but the first stamped out in one go."
+        if count == 0:
+            return []
+        first = self.instantiate(env)
+        if instrument.enabled: instrument.count('templates stamped', count-1)
+        return [first] + self.template.stamp_many(count - 1)
+    def get_template(self, env):
+        template = getattr(self, 'template', None)
+        if template is not None and template.types is env.types:
+            return template
+        return None
+    def type_ids(self):
+        "The ids of the types my own decls refer to."
+        ids = set(decl.type_id for decl in self.decls
+                  if isinstance(decl, VarDecl))
+        if self.extends: ids.add(self.extends)
+        return ids
     def populate(self, env):
         supe = self.super_definition(env)
         if supe:
@@ -67,7 +170,10 @@ class Definition(Struct('id extends decls')):
         for decl in self.decls:
             decl.build(env)
     def draw(self, env):
-        for drawer in self.pick_drawers(env) or env.inst.get_parts():
+        template = self.get_template(env)
+        drawers = (template.drawers if template is not None
+                   else self.pick_drawers(env))
+        for drawer in drawers or env.inst.get_parts():
             drawer.draw(env)
     def pick_drawers(self, env):
         defn = self
@@ -85,30 +191,217 @@ class Definition(Struct('id extends decls')):
         else:
             return None
 
+def invalidate(program, changed_ids):
+    """Drop the templates of program's Definitions that are named in
+    changed_ids or refer to those, directly or not."""
+    defns = [item for item in program if isinstance(item, Definition)]
+    changed_ids = set(changed_ids)
+    while True:
+        stale = set(defn.id for defn in defns
+                    if defn.id not in changed_ids
+                    and defn.type_ids() & changed_ids)
+        if not stale: break
+        changed_ids |= stale
+    for defn in defns:
+        if defn.id in changed_ids:
+            defn.template = None
+
+class Template(object):
+    """What instantiating a Definition makes, in a form quick to copy:
+    the shape of the instance, with its variables numbered as slots,
+    and the equations instantiating posts, over those slots. (The
+    equations may have more slots, for intermediate values.)"""
+    def __init__(self, types, inst, lin_exps, drawers):
+        self.types = types      # The type registry this holds within.
+        slots = {}              # variable -> slot number
+        self.shape = shape_of(inst, slots)
+        self.equations = [(lin_exp.constant,
+                           [(slots.setdefault(var, len(slots)), c)
+                            for var, c in lin_exp.items()])
+                          for lin_exp in lin_exps]
+        self.n_slots = len(slots)
+        self.drawers = drawers
+    def stamp(self):
+        "Make a fresh instance, with its constraints."
+        return self.stamp_many(1)[0]
+    def stamp_many(self, count):
+        "Make count fresh instances, with their constraints."
+        n, post, LinExp = self.n_slots, LC.post, LC.LinExp
+        variables = [LC.Variable() for _ in xrange(n * count)]
+        insts = []
+        for start in xrange(0, n * count, n):
+            slots = variables[start:start+n]
+            insts.append(build_shape(self.shape, slots))
+            for constant, terms in self.equations:
+                post(LinExp(constant, [(slots[slot], c) for slot, c in terms]))
+        return insts
+
+def shape_of(value, slots):
+    """A NumberInstance's shape is its variable's slot; an Instance's
+    is (type, [(key, shape)...])."""
+    if isinstance(value, NumberInstance):
+        var = value.lin_exp.a_variable()
+        return slots.setdefault(var, len(slots))
+    return (value.type, [(key, shape_of(part, slots))
+                         for key, part in value.mapping.iteritems()])
+
+def build_shape(shape, variables):
+    if isinstance(shape, int):
+        return NumberInstance(LC.LinExp(0, [(variables[shape], 1)]))
+    type_, fields = shape
+    inst = Instance(type_)
+    for key, part in fields:
+        inst.mapping[key] = build_shape(part, variables)
+    return inst
+
 
 class VarDecl(Struct('type_id decls')):
+    __slots__ = ()
     def build(self, env):
         type_ = env.types[self.type_id]
         for decl in self.decls:
-            inst = type_.instantiate(env)
+            if isinstance(decl, ArrayDeclarator):
+                inst = ArrayType(type_, int(decl.size)).instantiate(env)
+                elements = [inst.mapping[k] for k in xrange(int(decl.size))]
+            else:
+                inst = type_.instantiate(env)
+                elements = [inst]
             env.init(decl.id, inst)
             for id, rhs in decl.params:
-                LC.equate(inst.mapping[id], rhs.evaluate(env))
+                value = rhs.evaluate(env)
+                for element in elements:
+                    LC.equate(element.mapping[id], value)
     def draw(self, env):
         pass
 
 Declarator = Struct('id params', name='Declarator')
+ArrayDeclarator = Struct('id size params', name='ArrayDeclarator')
 
 
 class Constraints(Struct('equations')):
+    __slots__ = ()
     def build(self, env):
         for lhs, rhs in self.equations:
             LC.equate(lhs.evaluate(env), rhs.evaluate(env))
     def draw(self, env):
         pass
 
+class ConstraintLoop(Struct('index start stop equations')):
+    """Constraints for each whole number from start to stop, inclusive,
+    as the value of index. Only the first pass evaluates the equations;
+    the rest repost its linear equations with the variables shifted to
+    the array elements that pass's subscripts pick out -- unless the
+    index appears outside subscripts, or the elements overlap."""
+    __slots__ = ()
+    def build(self, env):
+        start = int(LC.as_scalar(self.start.evaluate(env)))
+        stop = int(LC.as_scalar(self.stop.evaluate(env)))
+        if stop < start:
+            return
+        body = Constraints(self.equations)
+        global subscripting
+        saved, subscripting = subscripting, []
+        mark = LC.Variable().id # Any newer variable is a temporary.
+        try:
+            lin_exps = LC.record(lambda: body.build(env.bind(self.index,
+                                                             start)))
+            subscripts = subscripting
+        finally:
+            subscripting = saved
+        for lin_exp in lin_exps:
+            LC.post(lin_exp)
+        # The same subscript expression picks the same element each pass.
+        subscripts = {repr(node): (node, element)
+                      for node, element in subscripts}.values()
+        pass_ = None
+        if not any(mentions(as_sexpr(expr), self.index)
+                   for equation in self.equations for expr in equation):
+            pass_ = LoopPass(lin_exps,
+                             [element for _, element in subscripts], mark)
+        for k in xrange(start+1, stop+1):
+            subenv = env.bind(self.index, k)
+            if pass_ is not None and pass_.compiled:
+                elements = [node.select(subenv) for node, _ in subscripts]
+                if len(set(map(id, elements))) == len(elements):
+                    pass_.stamp(elements)
+                    continue
+            body.build(subenv)
+    def draw(self, env):
+        pass
+
+subscripting = None # A list of (Index, element), while compiling a loop.
+
+def mentions(sexpr, id):
+    "Does the expression's s-expression have Name id outside subscripts?"
+    if not isinstance(sexpr, (tuple, list)) or not sexpr:
+        return False
+    if sexpr[0] == 'Name':
+        return sexpr[1] == id
+    if sexpr[0] == 'Index':
+        return mentions(sexpr[1], id)
+    return any(mentions(part, id) for part in sexpr)
+
+class LoopPass(object):
+    """One pass's linear equations, over keys standing for variables:
+    (r, path) for the part at path in the r'th subscripted element, an
+    int for a temporary made during the pass, or else the variable
+    itself, which every pass shares."""
+    def __init__(self, lin_exps, elements, mark):
+        origin = {}             # variable -> (r, path)
+        self.compiled = True    # False when elements overlap.
+        for r, element in enumerate(elements):
+            for path, var in leaves(element, ()):
+                if var in origin:
+                    self.compiled = False
+                origin[var] = (r, path)
+        temps = {}
+        def key(var):
+            if var in origin: return origin[var]
+            if var.id > mark: return temps.setdefault(var, len(temps))
+            return var
+        self.equations = [(lin_exp.constant,
+                           [(key(var), c) for var, c in lin_exp.items()])
+                          for lin_exp in lin_exps]
+        self.n_temps = len(temps)
+    def stamp(self, elements):
+        temps = [LC.Variable() for _ in xrange(self.n_temps)]
+        def variable(key):
+            if isinstance(key, tuple):
+                r, path = key
+                part = elements[r]
+                for field in path:
+                    part = part.mapping[field]
+                return part.lin_exp.a_variable()
+            if isinstance(key, int):
+                return temps[key]
+            return key
+        for constant, terms in self.equations:
+            LC.post(LC.LinExp(constant, [(variable(key), c)
+                                         for key, c in terms]))
+
+def variables_of(value):
+    "Return the variables of all the numbers within value."
+    variables, pending = [], [value]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, NumberInstance):
+            variables.append(value.lin_exp.a_variable())
+        else:
+            pending.extend(value.mapping.itervalues())
+    return variables
+
+def leaves(value, path):
+    "Generate (path, variable) for each number within value."
+    if isinstance(value, NumberInstance):
+        yield path, value.lin_exp.a_variable()
+    else:
+        for key, part in value.mapping.iteritems():
+            for leaf in leaves(part, path + (key,)):
+                yield leaf
+
 
 class Draw(Struct('drawables')):
+    __slots__ = ()
     def build(self, env):
         pass
     def draw(self, env):
@@ -116,34 +409,42 @@ class Draw(Struct('drawables')):
             drawable.draw(env)
 
 class DrawFunction(Struct('fn_name')):
+    __slots__ = ()
     def draw(self, env):
-        draw_functions[self.fn_name](**env.inst.mapping)
+        draw_functions[self.fn_name](env.canvas, **env.inst.mapping)
 
 class DrawName(Struct('name')):
+    __slots__ = ()
     def draw(self, env):
         self.name.evaluate(env).draw(env)
 
 
 class BinaryOp(Struct('arg1 arg2')):
+    __slots__ = ()
     def evaluate(self, env):
         return self.operate(self.arg1.evaluate(env),
                             self.arg2.evaluate(env))
 
-class Add(BinaryOp): operate = operator.add
-class Sub(BinaryOp): operate = operator.sub
-class Mul(BinaryOp): operate = operator.mul
-class Div(BinaryOp): operate = operator.div
+class Add(BinaryOp): __slots__ = (); operate = operator.add
+class Sub(BinaryOp): __slots__ = (); operate = operator.sub
+class Mul(BinaryOp): __slots__ = (); operate = operator.mul
+class Div(BinaryOp): __slots__ = (); operate = operator.div
 
 def Negate(expr):
     return Mul(Number(-1), expr)
 
 
 class Tuple(Struct('exprs')):
+    __slots__ = ()
     def evaluate(self, env):
         type_ = tuple_types[len(self.exprs)]
+        values = [expr.evaluate(env) for expr in self.exprs]
+        if all(isinstance(value, (int, float)) for value in values):
+            # A constant needs no variables or equations.
+            return LC.Compound(dict(zip(type_.fields, values)))
         inst = type_.instantiate(env)
-        for v, expr in zip(type_.fields, self.exprs):
-            LC.equate(inst.mapping[v], expr.evaluate(env))
+        for v, value in zip(type_.fields, values):
+            LC.equate(inst.mapping[v], value)
         return inst
 
 tuple_types = {
@@ -151,45 +452,64 @@ tuple_types = {
 }
 
 class Name(Struct('id')):
+    __slots__ = ()
     def evaluate(self, env):
         return env.fetch(self.id)
 
 class Dot(Struct('base field')):
+    __slots__ = ()
     def evaluate(self, env):
         return self.base.evaluate(env).mapping[self.field]
 
+class Index(Struct('base index')):
+    __slots__ = ()
+    def evaluate(self, env):
+        element = self.select(env)
+        if subscripting is not None:
+            subscripting.append((self, element))
+        return element
+    def select(self, env):
+        array = self.base.evaluate(env)
+        k = LC.as_scalar(self.index.evaluate(env))
+        assert k == int(k) and int(k) in array.mapping, \
+            "Index out of range: %r in %r" % (k, array)
+        return array.mapping[int(k)]
+
 class Number(Struct('value')):
+    __slots__ = ()
     def evaluate(self, env):
         return self.value
 
 
-# XXX just for the smoke test:
-
-def draw_foo(a, b):     
-    print 'draw foo', a.get_value(), b.get_value()
+def fold(node):
+    """Return a copy of the syntax tree node with each arithmetic
+    operation on number literals done, leaving its result as a
+    literal. (Though not division by zero: that's for run time.)"""
+    if isinstance(node, (list, tuple)):
+        return type(node)(fold(part) for part in node)
+    if not hasattr(node, '_fields'):
+        return node
+    node = type(node)(*[fold(getattr(node, f)) for f in node._fields])
+    if (isinstance(node, BinaryOp)
+            and isinstance(node.arg1, Number) and isinstance(node.arg2, Number)):
+        try:
+            return Number(node.operate(node.arg1.value, node.arg2.value))
+        except ZeroDivisionError:
+            pass
+    return node
 
-def draw_point(x, y):
-    print 'draw point', x.get_value(), y.get_value()
 
-def draw_line(start, end, **kwargs):
-    polyline([(start.x.get_value(), start.y.get_value()),
-              (end.x.get_value(),   end.y.get_value())])
-
-def coord_str(num):
-    s = '%g' % round(num, 1)
-    # Sometimes we get varying '-0' or '0' from run to run. Hide the
-    # variation:
-    return '0' if s == '-0' else s
+# XXX just for the smoke test:
 
-def xstr(x): return coord_str(x*xscale)
-def ystr(y): return coord_str(y*yscale)
+def draw_foo(canvas, a, b):
+    canvas.comment('draw foo %s %s' % (a.get_value(), b.get_value()))
 
-xscale = 40
-yscale = 40
+def draw_point(canvas, x, y):
+    canvas.comment('draw point %s %s' % (x.get_value(), y.get_value()))
 
-def polyline(points):
-    print ('<polyline points="%s" fill="transparent" stroke="black" stroke-width="1"/>'
-           % ', '.join('%s %s' % (xstr(x), ystr(y)) for x,y in points))
+def draw_line(canvas, start, end, **kwargs):
+    canvas.polyline([(start.x.get_value(), start.y.get_value()),
+                     (end.x.get_value(),   end.y.get_value())])
 
 draw_functions = dict(draw_foo=draw_foo,
                       draw_point=draw_point,
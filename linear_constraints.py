@@ -15,24 +15,461 @@ a Tuple class and handle it specially, but I think I've learned enough
 that it won't teach me more.
 """
 
+from array import array
+import multiprocessing
+
 import constraints
+import instrument
 import linear_equations
 
 class Variable(constraints.Variable):
+    def constrain(self, constraint):
+        if self.value is None:
+            assert self.constraints is not frozen, \
+                "Can't constrain %s: its network was frozen" % self
+            self.constraints.add(constraint)
+    def solve(self):
+        if self.constraints is frozen:
+            return              # Left undetermined by the network.
+        assert self.component, "Unconstrained: %r" % self
+        if instrument.enabled: instrument.count('get_value solves')
+        value = self.get_component().value(self)
+        if value is not None:
+            self.assign(value)
     def __str__(self):
         return '<Variable %x>' % id(self)
 
+LinExp = linear_equations.LinExp # The class for expressions built from now on.
+
+def use_lin_exps(kind):
+    "Choose a key of linear_equations.lin_exp_kinds."
+    global LinExp
+    assert kind in linear_equations.lin_exp_kinds, "Unknown kind: %r" % kind
+    LinExp = linear_equations.lin_exp_kinds[kind]
+
+backend = 'incremental'         # Key into linear_equations.backends.
+
+def use_backend(name):
+    "Choose how to solve components built from now on."
+    global backend
+    assert name in linear_equations.backends, "Unknown backend: %r" % name
+    backend = name
+
+class Component(constraints.Component):
+    """Also holds the component's system of equations. An incremental
+    system gets each equation as it's posted, presolved on its own; a
+    batch system, which solves only once asked for a value, gets them
+    only then (by flush), to presolve all together. Presolving assigns
+    values outside the system, so a contradiction is noted here too,
+    and takes back every value in the component."""
+    def __init__(self, constraints):
+        super(Component, self).__init__(constraints)
+        self.system = linear_equations.backends[backend]()
+        self.pending = list(constraints) # Not yet given to the system.
+        self.in_system = set()  # The variables the system has equations for.
+        self.aliases = {}       # variable -> (variable, scale, offset)
+        self.consistent = True
+    def absorb(self, other):
+        if not other.consistent:
+            self.contradict()
+        elif not self.consistent:
+            other.contradict()
+        super(Component, self).absorb(other)
+        self.system.absorb(other.system)
+        self.pending.extend(other.pending)
+        self.in_system |= other.in_system
+        self.aliases.update(other.aliases)
+        other.system = other.pending = other.in_system = other.aliases = None
+    def posted(self):
+        "A constraint of mine was just posted: give it to the system now?"
+        if not isinstance(self.system, linear_equations.Batch):
+            self.flush()
+    def contradict(self):
+        "My equations can't all hold: leave all my variables undetermined."
+        self.consistent = False
+        self.pending = []
+        for constraint in self.constraints:
+            for variable in constraint.get_variables():
+                variable.value = None
+    def flush(self):
+        "Give the system the pending equations, presolved if presolving."
+        if not self.pending: return
+        lin_exps = [constraint.lin_exp for constraint in self.pending]
+        self.pending = []
+        if presolving and len(lin_exps) == 1:
+            lin_exps = presolve_one(lin_exps[0], self.in_system, self.aliases)
+        elif presolving:
+            lin_exps = presolve(lin_exps, self.in_system, self.aliases)
+        for lin_exp in lin_exps:
+            # (A batch system takes a contradiction without a word.)
+            if lin_exp.is_inconsistent() or not self.system.add(lin_exp):
+                self.contradict()
+                return
+            self.in_system.update(lin_exp.variables())
+    def value(self, var):
+        "Return var's value if my equations determine it, else None."
+        self.flush()
+        if not self.consistent:
+            return None
+        root, scale, offset = find_alias(self.aliases, var)
+        value = root.value
+        if value is None:
+            value = self.system.value(root)
+        return None if value is None else scale * value + offset
+
 class Constraint(constraints.Constraint):
+    component_class = Component
     def __init__(self, lin_exp):
         self.lin_exp = lin_exp
-        for variable in lin_exp.variables():
-            variable.constrain(self)
+        self.connect()
     def get_variables(self):
         return self.lin_exp.variables()
     def solve(self):
-        eqns = [c.lin_exp for c in self.get_connected_constraints()]
-        for variable, value in linear_equations.solve_equations(eqns).items():
-            variable.assign(value)
+        for variable in self.get_variables():
+            variable.get_value()
+
+recording = None                # A list of LinExps, while in record().
+collecting = None               # A list of Constraints, while in collect().
+presolving = True               # Settle one-variable equations early?
+
+def post(lin_exp):
+    """Add the constraint lin_exp = 0 to the network and return it --
+    or, while recording, just note lin_exp. When presolving, an
+    equation of one variable that's in no component yet (or that it
+    already satisfies) just assigns it, and returns None; one that the
+    known values already contradict makes its component inconsistent."""
+    if recording is not None:
+        recording.append(lin_exp)
+        return None
+    if presolving and lin_exp.term_count() == 1:
+        var = lin_exp.a_variable()
+        value = value_of(lin_exp, var)
+        if var.value == value or (var.value is None and var.component is None):
+            var.assign(value)
+            if instrument.enabled: instrument.count('presolved')
+            return None
+    constraint = Constraint(lin_exp)
+    if presolving and substitute_known(lin_exp).is_inconsistent():
+        constraint.get_component().contradict()
+    else:
+        constraint.get_component().posted()
+    if instrument.enabled: instrument.count('equations')
+    if collecting is not None:
+        collecting.append(constraint)
+    return constraint
+
+def presolve(lin_exps, in_system, aliases):
+    """Simplify equations before a system gets them, rewriting each
+    (see rewrite) and settling what it can (see settle), repeating
+    while that settles more. Return the equations unsettled,
+    rewritten."""
+    users = {}                  # representative -> indices of lin_exps
+    for i, lin_exp in enumerate(lin_exps):
+        for var, _ in lin_exp.items():
+            if var.value is None:
+                root = find_alias(aliases, var)[0]
+                users.setdefault(root, []).append(i)
+    settled, n_aliased = set(), 0
+    pending = range(len(lin_exps))
+    while pending:
+        i = pending.pop()
+        if i in settled: continue
+        var = settle(rewrite(lin_exps[i], aliases), in_system, aliases, users)
+        if var is None: continue
+        settled.add(i)
+        if var is True:
+            continue
+        if var in aliases:
+            n_aliased += 1
+            moved = users.pop(var, [])
+            users.setdefault(aliases[var][0], []).extend(moved)
+            pending.extend(moved)
+        else:
+            pending.extend(users.get(var, ()))
+    if instrument.enabled:
+        instrument.count('presolved', len(settled))
+        instrument.count('aliased', n_aliased)
+    return [rewrite(lin_exp, aliases) for i, lin_exp in enumerate(lin_exps)
+            if i not in settled]
+
+def presolve_one(lin_exp, in_system, aliases):
+    "Like presolve, for a single equation, with no need to repeat."
+    reduced = rewrite(lin_exp, aliases)
+    var = settle(reduced, in_system, aliases, {})
+    if var is None:
+        return [reduced]
+    if instrument.enabled:
+        instrument.count('presolved')
+        if var is not True and var in aliases: instrument.count('aliased')
+    return []
+
+def settle(reduced, in_system, aliases, users):
+    """Try to settle a rewritten equation without a system: if it's
+    down to one unknown, assign it; if it says x = y + k or x = -y + k,
+    make x an alias of y, by adding to aliases. Variables in_system
+    are left as they are, for the system to assign, and never become
+    aliases. Return the variable assigned or made an alias, True for
+    a tautology, or None if unsettled."""
+    if reduced.is_tautology():
+        return True
+    n = reduced.term_count()
+    if n == 1:
+        var = reduced.a_variable()
+        if var in in_system:
+            return None
+        var.assign(value_of(reduced, var))
+        return var
+    if n == 2:
+        (x, a), (y, b) = reduced.items()
+        if abs(a) != abs(b) or (x in in_system and y in in_system):
+            return None
+        # Make the one with fewer equations the alias, so there are
+        # fewer to look at again.
+        if (len(users.get(x, ())) > len(users.get(y, ()))
+                and y not in in_system) or x in in_system:
+            x, a, y, b = y, b, x, a
+        aliases[x] = (y, -b / a, -reduced.constant / float(a))
+        return x
+    return None
+
+def rewrite(lin_exp, aliases):
+    """Return lin_exp with the values of variables that have them put
+    in, and each alias replaced by its representative."""
+    if all(var.value is None and var not in aliases
+           for var, _ in lin_exp.items()):
+        return lin_exp
+    constant, coefficients = lin_exp.constant, {}
+    for var, c in lin_exp.items():
+        if var.value is not None:
+            constant += c * var.value
+            continue
+        root, scale, offset = find_alias(aliases, var)
+        if root.value is None:
+            coefficients[root] = coefficients.get(root, 0) + c * scale
+            constant += c * offset
+        else:
+            constant += c * (scale * root.value + offset)
+    return LinExp(constant, coefficients.iteritems())
+
+def find_alias(aliases, var):
+    """Return (root, scale, offset) such that var = scale * root +
+    offset, where root is not an alias. Along the way, point each
+    alias on the path straight at root."""
+    path = []
+    while var in aliases:
+        path.append(var)
+        var = aliases[var][0]
+    scale, offset = 1, 0
+    for alias in reversed(path):
+        _, s, o = aliases[alias]
+        scale, offset = s * scale, s * offset + o
+        aliases[alias] = (var, scale, offset)
+    return var, scale, offset
+
+def value_of(lin_exp, var):
+    "The value of var that makes lin_exp, with only var's term, 0."
+    return -lin_exp.constant / float(lin_exp.coefficient(var))
+
+def substitute_known(lin_exp):
+    "Return lin_exp with the values of variables that have them put in."
+    if all(var.value is None for var, _ in lin_exp.items()):
+        return lin_exp
+    constant, terms = lin_exp.constant, []
+    for var, c in lin_exp.items():
+        if var.value is None:
+            terms.append((var, c))
+        else:
+            constant += c * var.value
+    return LinExp(constant, terms)
+
+def record(thunk):
+    "Call thunk(); return the LinExps it posted, instead of posting them."
+    global recording
+    saved, recording = recording, []
+    try:
+        thunk()
+        return recording
+    finally:
+        recording = saved
+
+def collect(thunk):
+    "Call thunk(); return its result and the Constraints it posted."
+    global collecting
+    saved, collecting = collecting, []
+    try:
+        return thunk(), collecting
+    finally:
+        if saved is not None:
+            saved.extend(collecting)
+        collecting = saved
+
+# Solving everything at once, with the big deferred components
+# (those of Batch systems) farmed out to worker processes.
+
+solve_jobs = 1                  # Worker processes; 1 means solve in-process.
+parallel_threshold = 200        # Smaller components get solved in-process.
+pool = None                     # The workers, once started.
+
+def use_solve_jobs(jobs):
+    "Choose how many processes solve_all may use."
+    global solve_jobs, pool
+    if pool is not None and jobs != solve_jobs:
+        pool.close()
+        pool = None
+    solve_jobs = jobs
+
+def solve_all(constraints, reuse=None):
+    """Give each variable of constraints the value its component
+    determines (if any). If reuse is a dict, unsolved components
+    whose equations (up to renaming variables) are among its keys
+    take their values from it instead of being solved; then reuse is
+    left holding just this call's such components, for next time.
+    (Only batch systems leave components unsolved till now: the
+    incremental one solves as equations are posted, so gains nothing
+    from reuse.)"""
+    components, members = [], {} # members: id(component) -> constraints
+    for constraint in constraints:
+        component = constraint.get_component()
+        if id(component) not in members:
+            members[id(component)] = []
+            components.append(component)
+        members[id(component)].append(constraint)
+    for component in components:
+        component.flush()
+    if instrument.enabled: note_network(components, members)
+    if reuse is not None:
+        kept, fresh, reused = {}, [], set()
+        for component in components:
+            if not (component.consistent and is_deferred(component.system)):
+                continue
+            eqs, variables = canonical_form(component.system.eqs)
+            values = reuse.get(eqs)
+            if values is None:
+                fresh.append((component, eqs, variables))
+                continue
+            kept[eqs] = values
+            reused.add(id(component))
+            if instrument.enabled: instrument.count('reused components')
+            for variable, value in zip(variables, values):
+                if value is not None and variable.value is None:
+                    variable.assign(value)
+        components = [component for component in components
+                      if id(component) not in reused]
+    big = [c for c in components if is_big(c.system)] if 1 < solve_jobs else []
+    if big:
+        global pool
+        if pool is None:
+            pool = multiprocessing.Pool(solve_jobs)
+        exports = [c.system.export() for c in big]
+        if instrument.enabled: instrument.count('parallel solves', len(big))
+        results = pool.map_async(linear_equations.solve_exported,
+                                 [job for _, job in exports])
+    big_ids = set(map(id, big))
+    for component in components:
+        if id(component) not in big_ids:
+            assign_values(component)
+    if big:
+        for component, (variables, _), solutions in zip(big, exports,
+                                                        results.get()):
+            component.system.take(variables, solutions)
+            assign_values(component)
+    if reuse is not None:
+        for _, eqs, variables in fresh:
+            kept[eqs] = [variable.value for variable in variables]
+        reuse.clear()
+        reuse.update(kept)
+
+class ValueTable(object):
+    """The values of some variables, once solved, in an array indexed
+    by variable id (less the least id), NaN marking the undetermined.
+    Looking one up never solves anything."""
+    def __init__(self, variables):
+        ids = [var.id for var in variables]
+        self.base = min(ids) if ids else 0
+        size = max(ids) - self.base + 1 if ids else 0
+        self.values = array('d', [nan]) * size
+        for var in variables:
+            value = var.value
+            if value is None and var.constraints:
+                value = var.get_component().value(var)
+            if value is not None:
+                self.values[var.id - self.base] = value
+    def get(self, var):
+        "Return var's value, or None if undetermined or not in the table."
+        i = var.id - self.base
+        if 0 <= i < len(self.values):
+            value = self.values[i]
+            if value == value:  # (Not NaN.)
+                return value
+        return None
+
+nan = float('nan')
+
+frozen = frozenset()            # The constraints of a frozen variable.
+
+def freeze(constraints):
+    """Once constraints are solved (all those of their components,
+    that is), take their network apart, leaving each of their
+    variables with just its value (or None) and no way to take on
+    more constraints. Variables, constraints, and components refer to
+    each other in cycles, so otherwise nothing of a network gets freed
+    until the cycle collector comes around; this way it goes as soon
+    as the caller drops constraints."""
+    roots = set()
+    for constraint in constraints:
+        if constraint.component is None:
+            continue            # Frozen already.
+        roots.add(constraint.get_component())
+        for variable in constraint.get_variables():
+            variable.constraints = frozen
+            variable.component = None
+        constraint.component = None
+    for root in roots:
+        root.parent = root.constraints = root.system = root.pending = None
+        root.in_system = root.aliases = None
+    if instrument.enabled:
+        instrument.count('frozen constraints', len(constraints))
+        instrument.count('frozen components', len(roots))
+
+def note_network(components, members):
+    instrument.count('components', len(components))
+    instrument.count('variables', len(set(
+        variable for component in components
+        for constraint in members[id(component)]
+        for variable in constraint.get_variables())))
+    for component in components:
+        instrument.peak('component equations', len(members[id(component)]))
+
+def canonical_form(lin_exps):
+    """Return the equations as a hashable value, with the variables
+    numbered in order of appearance; and those variables."""
+    numbers, variables, eqs = {}, [], []
+    for lin_exp in lin_exps:
+        terms = []
+        for var, c in sorted(lin_exp.items(), key=lambda (var, c): var.id):
+            if var not in numbers:
+                numbers[var] = len(variables)
+                variables.append(var)
+            terms.append((numbers[var], c))
+        eqs.append((lin_exp.constant, tuple(terms)))
+    return tuple(eqs), variables
+
+def is_deferred(system):
+    "Has system put off solving its equations?"
+    return (isinstance(system, linear_equations.Batch)
+            and system.solutions is None)
+
+def is_big(system):
+    "Is system worth the trip to a worker process?"
+    return is_deferred(system) and parallel_threshold <= len(system.eqs)
+
+def assign_values(component):
+    for constraint in component.constraints:
+        for variable in constraint.get_variables():
+            if variable.value is None:
+                value = component.value(variable)
+                if value is not None:
+                    variable.assign(value)
 
 def equate(expr1, expr2):
     zero(as_expression(expr1) - expr2)
@@ -42,7 +479,7 @@ def zero(value):
 
 def as_expression(value):
     if isinstance(value, (int, float)):
-        return Number(linear_equations.LinExp(value, ()))
+        return Number(LinExp(value, ()))
     assert isinstance(value, Expression)
     return value
 
@@ -59,9 +496,9 @@ class Expression(object):
     def coerce(self, value):
         abstract
     def combine(self, c, e2, c2):
-        abstract
+        return Combination(terms_of(c, self) + terms_of(c2, e2))
     def scale(self, c):
-        abstract
+        return Combination(terms_of(c, self))
     def __xor__(self, other):
         "Constrain me to equal other. (A giant abuse of notation.)"
         other = as_expression(other)
@@ -72,59 +509,44 @@ class Expression(object):
     def __sub__(self, value):  return self.combine(1, self.coerce(value), -1)
     def __mul__(self, value):  return self.scale(as_scalar(value))
     def __div__(self, value):  return self.scale(1. / as_scalar(value))
-    def __radd__(self, value): return self.coerce(value).combine(1, self, 1)
-    def __rsub__(self, value): return self.coerce(value).combine(1, self, -1)
+    def __radd__(self, value): return self.combine(1, self.coerce(value), 1)
+    def __rsub__(self, value): return self.combine(-1, self.coerce(value), 1)
     def __rmul__(self, value): return self.scale(as_scalar(value))
-    def __rdiv__(self, value): return self.coerce(value) / self
+    def __rdiv__(self, value):
+        return Combination(terms_of(1. / as_scalar(self), self.coerce(value)))
 
 class Number(Expression):
     def __init__(self, lin_exp=None):
         if lin_exp is None:
-            lin_exp = linear_equations.LinExp(0, [(Variable(), 1)])
+            lin_exp = LinExp(0, [(Variable(), 1)])
         self.lin_exp = lin_exp
     def as_constraints(self):
-        return [Constraint(self.lin_exp)]
+        return [post(self.lin_exp)]
     def as_scalar(self):
         assert self.lin_exp.is_constant()
         return self.lin_exp.constant
     def coerce(self, value):
-        value = as_expression(value)
-        assert isinstance(value, Number)
-        return value
-    def combine(self, c, e2, c2):
-        return Number(self.lin_exp.combine(c, e2.lin_exp, c2))
-    def scale(self, c):
-        return Number(self.lin_exp.scale(c))
+        return coerce_number(value)
     def get_value(self):
         return self.lin_exp.defines_var()[0].get_value()
     def __str__(self):
         return '<Number %r>' % self.lin_exp
 
+def coerce_number(value):
+    assert is_numeric(value), "Not a Number: %r" % (value,)
+    return value
+
 class Compound(Expression):
     def __init__(self, mapping):
         self.mapping = mapping
     def add_parts(self, dict):
         self.mapping.update(dict)
     def as_constraints(self):
-        return flatten(e.as_constraints() for e in self.mapping.values())
+        return Combination([(1, self)]).as_constraints()
     def as_scalar(self):
         assert False
     def coerce(self, value):
-        if isinstance(value, Compound):
-            mapping = value.mapping
-        elif isinstance(value, dict):
-            mapping = value
-        else:
-            assert False, "Not a Compound: %r" % (value,)
-        return Compound({k: v for k,v in mapping.iteritems()
-                         if k in self.mapping})
-    def combine(self, c, e2, c2):
-        return Compound({key: (c * self.mapping[key]
-                               + c2 * e2.mapping[key])
-                         for key in self.mapping.keys()})
-    def scale(self, c):
-        return Compound({key: c * self.mapping[key]
-                         for key in self.mapping.keys()})
+        return coerce_compound(value)
     def keys(self):
         return set(self.mapping.keys())
     def get_parts(self):
@@ -137,5 +559,83 @@ class Compound(Expression):
     def __str__(self):
         return '<Compound of %s>' % sorted(self.mapping.keys())
 
+def coerce_compound(value):
+    assert isinstance(value, (Compound, dict)) or (
+        isinstance(value, Combination) and not value.numeric), \
+        "Not a Compound: %r" % (value,)
+    return value
+
+class Combination(Expression):
+    """A linear combination of Numbers or of Compounds, with the
+    arithmetic left undone: an expression like (start + end) / 2 just
+    collects its terms here. When it gets used, as by zero(), we add
+    up the terms once per leaf field. Like actual Linogram, a
+    combination of Compounds has just the fields they all have. (HOP
+    p. 525.)"""
+    def __init__(self, terms):
+        self.terms = terms      # [(coefficient, leaf)], where a leaf
+                                # is a Number, number, Compound, or dict.
+        self.numeric = is_numeric(terms[0][1])
+    def as_constraints(self):
+        if self.numeric:
+            return [post(sum_terms(self.terms))]
+        return flatten(self.field(key).as_constraints()
+                       for key in self.keys())
+    def as_scalar(self):
+        lin_exp = sum_terms(self.terms)
+        assert lin_exp.is_constant()
+        return lin_exp.constant
+    def coerce(self, value):
+        return coerce_number(value) if self.numeric else coerce_compound(value)
+    def force(self):
+        "Return the sum as a Number or Compound."
+        if self.numeric:
+            return Number(sum_terms(self.terms))
+        return Compound({key: self.field(key).force() for key in self.keys()})
+    def get_value(self):
+        return self.force().get_value()
+    @property
+    def mapping(self):
+        return self.force().mapping
+    def keys(self):
+        return set.intersection(*[set(leaf.keys()) for _, leaf in self.terms])
+    def field(self, key):
+        return Combination([(c * k, leaf)
+                            for c, part in self.terms
+                            for k, leaf in terms_of(1, get_field(part, key))])
+    def __getattr__(self, name):
+        if name.startswith('__') or name in ('terms', 'numeric') or self.numeric:
+            raise AttributeError(name)
+        return self.field(name)
+    def __str__(self):
+        return '<Combination of %d terms>' % len(self.terms)
+
+def terms_of(c, expr):
+    "Return c * expr as a list of terms."
+    if isinstance(expr, Combination):
+        return [(c * k, leaf) for k, leaf in expr.terms]
+    return [(c, expr)]
+
+def is_numeric(value):
+    if isinstance(value, Combination):
+        return value.numeric
+    return isinstance(value, (int, float, Number))
+
+def get_field(part, key):
+    return part[key] if isinstance(part, dict) else part.mapping[key]
+
+def sum_terms(terms):
+    "Add up numeric terms into one LinExp."
+    constant, coefficients = 0, {}
+    for c, leaf in terms:
+        if isinstance(leaf, Number):
+            lin_exp = leaf.lin_exp
+            constant += c * lin_exp.constant
+            for var, k in lin_exp.items():
+                coefficients[var] = coefficients.get(var, 0) + c * k
+        else:
+            constant += c * leaf
+    return LinExp(constant, coefficients.iteritems())
+
 def flatten(lists):
     return sum(lists, [])
@@ -3,29 +3,24 @@ Solve sparse systems of linear equations.
 """
 
 from __future__ import division
+from array import array
+from bisect import bisect_left
+from functools import partial
+import heapq
+from itertools import izip
 
-class LinExp(object):
-    "A linear expression in some variables."
-    def __init__(self, constant, terms):
-        self.constant = constant
-        self.terms = {var: val for var, val in terms if val != 0}
-    def combine(self, c, e2, c2):
-        return LinExp(c * self.constant + c2 * e2.constant,
-                      ((var, (c * self.coefficient(var)
-                              + c2 * e2.coefficient(var)))
-                       for var in self.variables() | e2.variables()))
-    def scale(self, c):
-        return self.combine(c, zero, 0)
+import instrument
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class LinExpBase(object):
+    "What's common to the representations of linear expressions."
+    __slots__ = ()
     def add(self, e2):
         return self.combine(1, e2, 1)
-    def coefficient(self, variable):
-        return self.terms.get(variable, 0)
-    def variables(self):
-        return set(self.terms.iterkeys())
-    def a_variable(self):
-        return next(self.terms.iterkeys(), None)
-    def is_constant(self):
-        return not self.terms
     # The remaining methods treat LinExps as equations implicitly ==
     # 0. So one is inconsistent if it's something like 5==0, it
     # defines a variable if it's something like 1*x-3==0 (with just
@@ -34,23 +29,27 @@ class LinExp(object):
         return self.is_constant() and self.constant != 0
     def is_tautology(self):
         return self.is_constant() and self.constant == 0
-    def defines_var(self):
-        vars = self.terms.keys()
-        return (vars if len(vars) == 1 and self.coefficient(vars[0]) == 1
-                else ())
     def substitute_for(self, var, eq):
         """Return an equivalent equation with var eliminated by
         resolving against eq (which must have a term for var)."""
         # self - (self[var]/eq[var]) * eq
         c = -self.coefficient(var) / eq.coefficient(var)
         return self.combine(1, eq, c)
-    def normalize(self):
+    def normalize(self, var=None):
         """Return an equivalent equation with a variable's coefficient
-        rescaled to 1."""
-        var = self.a_variable()
+        (var's, if given) rescaled to 1."""
+        if var is None: var = self.a_variable()
         return self.scale(1 / self.coefficient(var))
+    # The in-place versions. Use them only on LinExps nobody else holds.
+    def eliminate(self, var, eq):
+        "Like substitute_for, but updating me in place. Return self."
+        return self.iadd_scaled(eq, -self.coefficient(var) / eq.coefficient(var))
+    def inormalize(self, var=None):
+        "Like normalize, in place. Return self."
+        if var is None: var = self.a_variable()
+        return self.iscale(1 / self.coefficient(var))
     def __repr__(self):
-        items = sorted(self.terms.items())
+        items = sorted(self.items())
         if self.constant:
             items = [('', self.constant)] + items
         if not items: return '(0 = 0)'
@@ -65,32 +64,445 @@ class LinExp(object):
         return '(0 = %s%s)' % (format(items[0]),
                                ''.join(map(combiner, items[1:])))
 
+class LinExp(LinExpBase):
+    "A linear expression in some variables."
+    def __init__(self, constant, terms):
+        self.constant = constant
+        self.terms = {var: val for var, val in terms if val != 0}
+    def combine(self, c, e2, c2):
+        return LinExp(c * self.constant + c2 * e2.constant,
+                      ((var, (c * self.coefficient(var)
+                              + c2 * e2.coefficient(var)))
+                       for var in self.variables() | e2.variables()))
+    def scale(self, c):
+        return self.combine(c, zero, 0)
+    def copy(self):
+        return LinExp(self.constant, self.terms.iteritems())
+    def iadd_scaled(self, eq, c):
+        "Add c * eq to me in place, dropping terms that cancel. Return self."
+        if c == 0: return self
+        terms = self.terms
+        self.constant += c * eq.constant
+        for var, k in eq.items():
+            sum_ = terms.get(var, 0) + c * k
+            if sum_ == 0: terms.pop(var, None)
+            else:         terms[var] = sum_
+        return self
+    def iscale(self, c):
+        if c == 0:
+            self.terms.clear()
+        else:
+            for var in self.terms:
+                self.terms[var] *= c
+        self.constant *= c
+        return self
+    def coefficient(self, variable):
+        return self.terms.get(variable, 0)
+    def variables(self):
+        return set(self.terms.iterkeys())
+    def items(self):
+        return self.terms.iteritems()
+    def term_count(self):
+        return len(self.terms)
+    def a_variable(self):
+        return next(self.terms.iterkeys(), None)
+    def is_constant(self):
+        return not self.terms
+    def defines_var(self):
+        vars = self.terms.keys()
+        return (vars if len(vars) == 1 and self.coefficient(vars[0]) == 1
+                else ())
+
+class ArrayLinExp(LinExpBase):
+    """A linear expression in variables with integer .id attributes,
+    its terms kept in parallel arrays sorted by id. This takes less
+    memory than a dict, combines by merging, and always has the same
+    order of terms (so the same rounding) from run to run."""
+    __slots__ = ('constant', 'ids', 'vars', 'coefficients')
+    def __init__(self, constant, terms):
+        terms = sorted((var.id, var, c) for var, c in terms if c != 0)
+        self.constant = constant
+        self.ids = array('l', [id for id, _, _ in terms])
+        self.vars = tuple(var for _, var, _ in terms)
+        self.coefficients = array('d', [c for _, _, c in terms])
+    @classmethod
+    def make(cls, constant, ids, vars, coefficients):
+        self = cls.__new__(cls)
+        self.constant = constant
+        self.ids, self.vars, self.coefficients = ids, vars, coefficients
+        return self
+    def combine(self, c, e2, c2):
+        if c2 == 0:
+            return self.scale(c)
+        if not isinstance(e2, ArrayLinExp):
+            e2 = ArrayLinExp(e2.constant, e2.items())
+        ids1, vars1, cs1 = self.ids, self.vars, self.coefficients
+        ids2, vars2, cs2 = e2.ids, e2.vars, e2.coefficients
+        ids, vars, cs = array('l'), [], array('d')
+        i, j, n1, n2 = 0, 0, len(ids1), len(ids2)
+        while i < n1 or j < n2:
+            if j == n2 or (i < n1 and ids1[i] < ids2[j]):
+                id, var, coeff = ids1[i], vars1[i], c * cs1[i]
+                i += 1
+            elif i == n1 or ids2[j] < ids1[i]:
+                id, var, coeff = ids2[j], vars2[j], c2 * cs2[j]
+                j += 1
+            else:
+                id, var, coeff = ids1[i], vars1[i], c * cs1[i] + c2 * cs2[j]
+                i += 1
+                j += 1
+            if coeff != 0:
+                ids.append(id)
+                vars.append(var)
+                cs.append(coeff)
+        return ArrayLinExp.make(c * self.constant + c2 * e2.constant,
+                                ids, tuple(vars), cs)
+    def scale(self, c):
+        if c == 0:
+            return ArrayLinExp.make(0, array('l'), (), array('d'))
+        return ArrayLinExp.make(c * self.constant, self.ids, self.vars,
+                                array('d', [c * x for x in self.coefficients]))
+    # The arrays are never changed in place, so can be shared.
+    def copy(self):
+        return ArrayLinExp.make(self.constant, self.ids, self.vars,
+                                self.coefficients)
+    def iadd_scaled(self, eq, c):
+        return self.become(self.combine(1, eq, c))
+    def iscale(self, c):
+        return self.become(self.scale(c))
+    def become(self, other):
+        self.constant, self.ids = other.constant, other.ids
+        self.vars, self.coefficients = other.vars, other.coefficients
+        return self
+    def coefficient(self, variable):
+        i = bisect_left(self.ids, variable.id)
+        if i < len(self.ids) and self.ids[i] == variable.id:
+            return self.coefficients[i]
+        return 0
+    def variables(self):
+        return set(self.vars)
+    def items(self):
+        return izip(self.vars, self.coefficients)
+    def term_count(self):
+        return len(self.vars)
+    def a_variable(self):
+        return self.vars[0] if self.vars else None
+    def is_constant(self):
+        return not self.vars
+    def defines_var(self):
+        return (self.vars if len(self.vars) == 1 and self.coefficients[0] == 1
+                else ())
+
 zero = LinExp(0, ())
 
-def solve_equations(eqs):
+# The representations of LinExps, by name.
+lin_exp_kinds = dict(dict=LinExp, array=ArrayLinExp)
+
+def solve_equations(eqs, sparse=False):
     """Return a dict mapping variables to values, for those variables
     eqs constrains to a value. An eq is a LinExp implicitly equated to
-    0."""
-    consistent, eqs = reduce_equations(eqs)
+    0. If sparse, pivot to keep the equations small while solving."""
+    reduce = sparse_reduce_equations if sparse else reduce_equations
+    if instrument.enabled:
+        stats = {}
+        consistent, eqs = reduce(eqs, stats)
+        instrument.count('substitutions', stats['substitutions'])
+        instrument.peak('equation terms', stats['widest'])
+    else:
+        consistent, eqs = reduce(eqs)
     if not consistent:
         return {}               # or None, or what?
     return {var: -le.constant
             for le in eqs
             for var in le.defines_var()}
 
-def reduce_equations(eqs):
+def reduce_equations(eqs, stats=None):
     """Try to reduce eqs to an equivalent system with each variable
     defined by a single equation. The first result is False if the
-    eqs are inconsistent. The result may still be underconstrained."""
+    eqs are inconsistent. The result may still be underconstrained.
+    If you pass a stats dict, it gets fill-in statistics."""
+    if stats is not None: start_stats(stats, eqs)
+    eqs = [eq.copy() for eq in eqs]
     for i, eqi in enumerate(eqs):
         var = eqi.a_variable()
         if not var: continue
         for j, eqj in enumerate(eqs):
             if i == j: continue
-            eqs[j] = eqj.substitute_for(var, eqi)
-            if eqs[j].is_inconsistent():
+            if stats is not None: before = eqj.variables()
+            eqj.eliminate(var, eqi)
+            if stats is not None: note_substitution(stats, before, eqj)
+            if eqj.is_inconsistent():
                 return False, eqs
-    return True, [eq.normalize() for eq in eqs if not eq.is_tautology()]
+        if stats is not None: note_terms(stats, eqs)
+    eqs = [eq.inormalize() for eq in eqs if not eq.is_tautology()]
+    if stats is not None: stats['terms_out'] = count_terms(eqs)
+    return True, eqs
+
+def sparse_reduce_equations(eqs, stats=None):
+    """Like reduce_equations, but choose pivots by the Markowitz
+    heuristic, to limit fill-in: eliminate from short equations,
+    on variables that appear in few others, whose coefficients aren't
+    too small relative to the rest of their equation. Substitute only
+    into the equations having the pivot variable."""
+    eqs = [eq.copy() for eq in eqs]
+    if stats is not None: start_stats(stats, eqs)
+    if any(eq.is_inconsistent() for eq in eqs):
+        return False, eqs
+    having = {}                 # variable -> indices of eqs having it
+    for i, eq in enumerate(eqs):
+        for var in eq.variables():
+            having.setdefault(var, set()).add(i)
+    pivots = []                 # (eq index, variable)
+    pending = [(eq.term_count(), i) for i, eq in enumerate(eqs)]
+    heapq.heapify(pending)
+    while pending:
+        i, var = pick_markowitz_pivot(eqs, pending, having)
+        if var is None: break
+        pivots.append((i, var))
+        # Scaled so var's coefficient is exactly 1, eliminating var
+        # leaves exactly 0 of it, not a rounding error's worth.
+        eqi = eqs[i].inormalize(var)
+        for j in having.pop(var):
+            if j == i: continue
+            eqj = eqs[j]
+            if stats is not None: before = eqj.variables()
+            eqj.eliminate(var, eqi)
+            if stats is not None: note_substitution(stats, before, eqj)
+            if eqj.is_inconsistent():
+                return False, eqs
+            for v, _ in eqi.items():  # Only these can come or go.
+                if v == var: continue
+                if eqj.coefficient(v) == 0: having[v].discard(j)
+                else:                       having[v].add(j)
+        if stats is not None: note_terms(stats, eqs)
+    eqs = [eqs[i] for i, _ in pivots]
+    if stats is not None: stats['terms_out'] = count_terms(eqs)
+    return True, eqs
+
+markowitz_search = 4            # How many of the shortest eqs to consider.
+pivot_threshold = 0.1           # Smallest acceptable |coefficient| ratio.
+
+def pick_markowitz_pivot(eqs, pending, having):
+    """Pop a pending equation and pick its pivot variable, or return
+    (None, None) if none are left but tautologies. Among the few
+    shortest equations, take the acceptable pivot of least Markowitz
+    cost (r-1)*(c-1)."""
+    candidates = []
+    while pending and len(candidates) < markowitz_search:
+        n, i = heapq.heappop(pending)
+        if n != eqs[i].term_count():  # Stale entry: requeue at its new size.
+            heapq.heappush(pending, (eqs[i].term_count(), i))
+        elif n:                     # (Drop tautologies.)
+            candidates.append(i)
+            if n == 1: break
+    if not candidates:
+        return None, None
+    best = None
+    for i in candidates:
+        eq = eqs[i]
+        r = eq.term_count() - 1
+        biggest = max(abs(c) for _, c in eq.items())
+        for var, c in eq.items():
+            if abs(c) < pivot_threshold * biggest: continue
+            key = (r * (len(having[var]) - 1), -abs(c) / biggest)
+            if best is None or key < best[0]:
+                best = key, i, var
+    _, i, var = best
+    for j in candidates:
+        if j != i:
+            heapq.heappush(pending, (eqs[j].term_count(), j))
+    return i, var
+
+def start_stats(stats, eqs):
+    n = count_terms(eqs)
+    stats.update(terms_in=n, terms_peak=n, terms_out=n,
+                 fill_in=0, substitutions=0,
+                 widest=max([eq.term_count() for eq in eqs] or [0]))
+
+def note_substitution(stats, variables_before, after):
+    stats['substitutions'] += 1
+    stats['fill_in'] += len(after.variables() - variables_before)
+    stats['widest'] = max(stats['widest'], after.term_count())
+
+def note_terms(stats, eqs):
+    stats['terms_peak'] = max(stats['terms_peak'], count_terms(eqs))
+
+def count_terms(eqs):
+    return sum(eq.term_count() for eq in eqs)
+
+class Reducer(object):
+    """A system of equations kept in reduced row-echelon form as
+    they're added: each row defines its pivot variable in terms of
+    non-pivot variables only. So adding an equation costs a
+    substitution per pivot it mentions, plus one for each row
+    mentioning its new pivot; and looking up a value is cheap."""
+    def __init__(self):
+        self.rows = {}          # pivot variable -> its defining equation
+        self.uses = {}          # non-pivot variable -> pivots whose rows have it
+        self.consistent = True
+    def add(self, eq):
+        """Add eq to the system. Return False if that makes it
+        inconsistent."""
+        eq = eq.copy()
+        pivots = [var for var, _ in eq.items() if var in self.rows]
+        for var in pivots:
+            eq.eliminate(var, self.rows[var])
+        if instrument.enabled:
+            instrument.count('substitutions', len(pivots))
+            instrument.peak('equation terms', eq.term_count())
+        if eq.is_tautology():
+            return self.consistent
+        if eq.is_inconsistent():
+            self.consistent = False
+            return False
+        pivot = self.pick_pivot(eq)
+        row = eq.inormalize(pivot)
+        users = self.uses.pop(pivot, ())
+        for p in users:
+            self.eliminate_from_row(p, pivot, row)
+        if instrument.enabled: instrument.count('substitutions', len(users))
+        self.rows[pivot] = row
+        for var in row.variables():
+            if var != pivot:
+                self.uses.setdefault(var, set()).add(pivot)
+        return self.consistent
+    def pick_pivot(self, eq):
+        """Choose the variable appearing in the fewest rows (so the
+        fewest to update), among those with a coefficient not too small."""
+        biggest = max(abs(c) for _, c in eq.items())
+        return min((var for var, c in eq.items()
+                    if pivot_threshold * biggest <= abs(c)),
+                   key=lambda var: len(self.uses.get(var, ())))
+    def eliminate_from_row(self, p, pivot, row):
+        "Substitute row, defining pivot, into p's row."
+        p_row = self.rows[p].eliminate(pivot, row)
+        for var, _ in row.items():  # Only these can come or go.
+            if var == pivot: continue
+            if p_row.coefficient(var) != 0:
+                self.uses.setdefault(var, set()).add(p)
+            else:
+                users = self.uses.get(var)
+                if users is not None:
+                    users.discard(p)
+                    if not users: del self.uses[var]
+    def absorb(self, other):
+        "Take on other's equations, whose variables must not overlap mine."
+        self.rows.update(other.rows)
+        self.uses.update(other.uses)
+        self.consistent = self.consistent and other.consistent
+    def value(self, var):
+        "Return var's value if the system determines it, else None."
+        row = self.rows.get(var)
+        if self.consistent and row is not None and row.term_count() == 1:
+            return -row.constant / row.coefficient(var)
+        return None
+    def solutions(self):
+        "Return a dict like solve_equations'."
+        if not self.consistent: return {}
+        return {var: -row.constant / row.coefficient(var)
+                for var, row in self.rows.iteritems()
+                if row.term_count() == 1}
+
+class Batch(object):
+    """A system that just collects its equations, to solve them all at
+    once when first asked for a value (and again after more come)."""
+    def __init__(self, solve):
+        self.solve = solve
+        self.eqs = []
+        self.solutions = None
+    def add(self, eq):
+        self.eqs.append(eq)
+        self.solutions = None
+        return True
+    def absorb(self, other):
+        self.eqs.extend(other.eqs)
+        self.solutions = None
+    def value(self, var):
+        if self.solutions is None:
+            if instrument.enabled: instrument.count('batch solves')
+            self.solutions = self.solve(list(self.eqs))
+        return self.solutions.get(var)
+    def export(self):
+        """Return (variables, job): a job for solve_exported to do,
+        perhaps in another process, and the variables its columns mean."""
+        variables, _, rows, columns, coefficients, rhs = export_matrix(self.eqs)
+        return variables, (self.solve, rows, columns, coefficients, rhs)
+    def take(self, variables, solutions):
+        "Accept solve_exported's result for my export()."
+        self.solutions = {variables[j]: value
+                          for j, value in solutions.iteritems()}
+
+def solve_incrementally(eqs):
+    reducer = Reducer()
+    for eq in eqs:
+        reducer.add(eq)
+    return reducer.solutions()
+
+
+def export_matrix(eqs):
+    """Return eqs in coordinate (triplet) form: (variables, index,
+    rows, columns, coefficients, rhs), where variables[index[v]] == v
+    and the eqs say sum(coefficients[k] * x[columns[k]] for k with
+    rows[k] == i) == rhs[i]."""
+    variables, index = [], {}
+    rows, columns, coefficients = [], [], []
+    for i, eq in enumerate(eqs):
+        for var, c in eq.items():
+            if var not in index:
+                index[var] = len(variables)
+                variables.append(var)
+            rows.append(i)
+            columns.append(index[var])
+            coefficients.append(c)
+    return (variables, index, rows, columns, coefficients,
+            [-eq.constant for eq in eqs])
+
+def solve_exported((solve, rows, columns, coefficients, rhs)):
+    """Apply solve to equations in export_matrix's form, with column
+    numbers standing for the variables; return {column: value}."""
+    terms = [[] for _ in rhs]
+    for i, j, c in izip(rows, columns, coefficients):
+        terms[i].append((j, c))
+    return solve([LinExp(-b, ts) for b, ts in izip(rhs, terms)])
+
+numpy_threshold = 50        # Fewer eqs than this get solved in Python.
+numpy_limit = 2000          # So do eqs in more variables than this.
+
+def numpy_solve_equations(eqs):
+    """Like solve_equations, but by numerical linear algebra, when
+    NumPy is available and eqs are many enough to pay for it, yet few
+    enough for a dense matrix (whose SVD takes time cubic in its
+    size). One thin SVD of the coefficient matrix gives both the
+    least-squares solution and the row space: a variable is
+    determined when its unit vector lies in the row space."""
+    if numpy is None or len(eqs) < numpy_threshold:
+        return solve_equations(eqs, sparse=True)
+    variables, _, rows, columns, coefficients, rhs = export_matrix(eqs)
+    if numpy_limit < len(variables) or numpy_limit < len(eqs):
+        return solve_equations(eqs, sparse=True)
+    if instrument.enabled: instrument.count('numpy solves')
+    if not variables:
+        return {}
+    shape = (len(eqs), len(variables))
+    A = numpy.zeros(shape)
+    numpy.add.at(A, (rows, columns), coefficients)
+    u, s, vt = numpy.linalg.svd(A, full_matrices=False)
+    b = numpy.array(rhs)
+    tolerance = max(shape) * numpy.finfo(float).eps * (s[0] if len(s) else 0)
+    rank = int((s > tolerance).sum())
+    u, s, vt = u[:, :rank], s[:rank], vt[:rank]
+    x = vt.T.dot(u.T.dot(b) / s)   # The pseudo-inverse of A, applied to b.
+    if numpy.abs(A.dot(x) - b).max() > 1e-9 * (1 + numpy.abs(b).max()):
+        return {}               # Inconsistent.
+    # The squared length of each unit vector's part outside the row space:
+    off_row_space = 1 - (vt**2).sum(axis=0)
+    return {var: float(x[j])
+            for j, var in enumerate(variables) if off_row_space[j] <= 1e-10}
+
+# Ways to hold a component's equations, by name.
+backends = dict(incremental=Reducer,
+                python=lambda: Batch(partial(solve_equations, sparse=True)),
+                numpy=lambda: Batch(numpy_solve_equations))
 
 
 def mkeq(constant, dict):
@@ -102,6 +514,8 @@ eqs1 = [mkeq(13, dict(x=1)),
 #. (True, [(0 = -13 + x), (0 = -3.5 + y)])
 ## solve_equations(eqs1)
 #. {'y': 3.5, 'x': 13.0}
+## solve_incrementally(eqs1)
+#. {'y': 3.5, 'x': 13.0}
 
 eqs2 = [mkeq(12, dict(x=1, y=1)),
         mkeq(2, dict(x=1, y=-1))]
@@ -109,6 +523,8 @@ eqs2 = [mkeq(12, dict(x=1, y=1)),
 #. (True, [(0 = -5 + y), (0 = -7 + x)])
 ## solve_equations(eqs2)
 #. {'y': 5.0, 'x': 7.0}
+## solve_incrementally(eqs2)
+#. {'y': 5.0, 'x': 7.0}
 
 eqs3 = [mkeq(3, dict(x=1, y=1)),
         mkeq(5, dict(y=1, z=1)),
@@ -117,6 +533,8 @@ eqs3 = [mkeq(3, dict(x=1, y=1)),
 #. (True, [(0 = -5 + y + z), (0 = 2 + x - z)])
 ## solve_equations(eqs3)
 #. {}
+## solve_incrementally(eqs3)
+#. {}
 
 eqs4 = [mkeq( 8, dict(x=1, y=2)),
         mkeq(10, dict(     y=2, z=1)),
@@ -125,6 +543,10 @@ eqs4 = [mkeq( 8, dict(x=1, y=2)),
 #. (True, [(0 = -3 + y), (0 = -2 + x), (0 = -4 + z)])
 ## solve_equations(eqs4)
 #. {'y': 3.0, 'x': 2.0, 'z': 4.0}
+## solve_incrementally(eqs4)
+#. {'y': 3.0, 'x': 2.0, 'z': 4.0}
+## solve_exported((solve_incrementally,) + export_matrix(eqs4)[2:])
+#. {0: 3.0, 1: 2.0, 2: 4.0}
 
 eqs5 = [mkeq(1, dict(starty=1)),
         mkeq(2, dict(y=1)),
@@ -135,3 +557,32 @@ eqs5 = [mkeq(1, dict(starty=1)),
 #. (False, [(0 = -1 + starty), (0 = -2 + y), (0 = -1)])
 ## solve_equations(eqs5)
 #. {}
+## solve_incrementally(eqs5)
+#. {}
+
+# An 'arrowhead' system: pivoting first on the long equation fills in
+# all the short ones.
+arrow = ([mkeq(10, {v: 1 for v in 'abcdefgh'})]
+         + [mkeq(1, {v: 1, 'a': -1}) for v in 'bcdefgh'])
+plain_stats, sparse_stats = {}, {}
+## solve_equations(list(arrow))
+#. {'a': 0.37500000000000044, 'c': 1.375, 'b': 1.375, 'e': 1.3750000000000002, 'd': 1.3750000000000002, 'g': 1.3749999999999991, 'f': 1.3750000000000004, 'h': 1.3750000000000004}
+## solve_equations(arrow, sparse=True)
+#. {'a': 0.375, 'c': 1.375, 'b': 1.375, 'e': 1.375, 'd': 1.375, 'g': 1.375, 'f': 1.375, 'h': 1.375}
+## reduce_equations(list(arrow), plain_stats)[0], sparse_reduce_equations(arrow, sparse_stats)[0]
+#. (True, True)
+## plain_stats
+#. {'fill_in': 87, 'terms_in': 22, 'widest': 8, 'terms_out': 8, 'substitutions': 56, 'terms_peak': 57}
+## sparse_stats
+#. {'fill_in': 0, 'terms_in': 22, 'widest': 8, 'terms_out': 8, 'substitutions': 14, 'terms_peak': 22}
+
+# A cycle with coefficients that aren't powers of 2: eliminating a
+# pivot must leave none of it behind, not even a rounding error.
+cycle = [mkeq(k, {'x%02d' % k: 1, 'x%02d' % ((k+1) % 24): .1,
+                  'x%02d' % ((k+2) % 24): .3})
+         for k in range(24)]
+cycle_solution = solve_equations(cycle, sparse=True)
+## len(cycle_solution)
+#. 24
+## abs(cycle_solution['x00'] - solve_incrementally(cycle)['x00']) < 1e-9
+#. True
@@ -2,28 +2,396 @@
 Run the interpreter from the command line.
 """
 
-import sys
-import interpreter, parser
+import argparse, errno, json, multiprocessing, os, socket, SocketServer
+import stat, sys, time
+import traceback
+import instrument, interpreter, linear_constraints, linear_equations
+import parse_cache, parser
 
 def main(argv):
+    options = parse_options(argv)
+    configure(options.solver, options.lin_exps, options.solve_jobs)
+    if options.stats:
+        instrument.enable()
+    cache_dir = None if options.no_cache else options.cache_dir
+    library = parse_files(options.libs, cache_dir)
+    if library is None:
+        return 1
+    if options.batch:
+        return batch(options, library, cache_dir)
+    if options.serve:
+        serve(library, sys.stdin, sys.stdout)
+        return 0
+    if options.socket:
+        return serve_socket(library, options.socket)
+    if options.watch:
+        watch(options, cache_dir)
+        return 0
+    defs = parse_files(options.filenames, cache_dir)
+    if defs is None:
+        return 1
+    canvas = interpreter.run(library + defs)
+    with instrument.timing('write'):
+        if options.output == '-':
+            canvas.write(sys.stdout)
+        else:
+            canvas.save(options.output)
+    if options.stats:
+        sys.stderr.write(instrument.format_report(instrument.report()))
+    return 0
+
+def parse_options(argv):
+    argparser = argparse.ArgumentParser(prog=argv[0],
+                                        description="Draw Linogram figures.")
+    argparser.add_argument('filenames', nargs='*', metavar='FILE')
+    argparser.add_argument('-o', '--output', default='-',
+                           help="SVG file to write, gzipped if named *.svgz"
+                                " (default stdout)")
+    argparser.add_argument('--lib', dest='libs', action='append', default=[],
+                           metavar='FILE',
+                           help="definitions to load before the FILEs"
+                                " (repeatable)")
+    argparser.add_argument('--batch', action='store_true',
+                           help="render each FILE as a separate program,"
+                                " in parallel, into --out-dir (so no two"
+                                " FILEs may share a base name)")
+    argparser.add_argument('--out-dir', default='.',
+                           help="where --batch writes (default %(default)s)")
+    argparser.add_argument('--svgz', action='store_true',
+                           help="have --batch write gzipped SVG")
+    argparser.add_argument('-j', '--jobs', type=int,
+                           default=multiprocessing.cpu_count(),
+                           help="--batch worker processes (default %(default)s)")
+    argparser.add_argument('--watch', action='store_true',
+                           help="redraw whenever a FILE or --lib changes,"
+                                " reusing solutions unless --solver is"
+                                " incremental")
+    argparser.add_argument('--serve', action='store_true',
+                           help="render programs sent as JSON lines on stdin,"
+                                " replying on stdout")
+    argparser.add_argument('--socket', metavar='PATH',
+                           help="like --serve, but on a Unix socket")
+    argparser.add_argument('--stats', action='store_true',
+                           help="report times and counts on stderr"
+                                " (or, serving, in each reply)")
+    argparser.add_argument('--solver',
+                           choices=sorted(linear_equations.backends),
+                           help="how to solve constraints (default %s,"
+                                " or with --watch %s)"
+                                % (linear_constraints.backend, watch_backend))
+    argparser.add_argument('--solve-jobs', type=int, default=1,
+                           help="processes for solving big components,"
+                                " outside --batch, with a batch --solver"
+                                " (default %(default)s)")
+    argparser.add_argument('--lin-exps', default='dict',
+                           choices=sorted(linear_equations.lin_exp_kinds),
+                           help="how to represent linear expressions"
+                                " (default %(default)s)")
+    argparser.add_argument('--cache-dir', default=parse_cache.default_dir(),
+                           help="where to keep parsed files, if anywhere;"
+                                " used only if it's yours and not writable"
+                                " by others (default $MINILINOGRAM_CACHE)")
+    argparser.add_argument('--no-cache', action='store_true',
+                           help="parse every file afresh, even given"
+                                " a --cache-dir")
+    options = argparser.parse_args(argv[1:])
+    if options.solver is None:
+        options.solver = (watch_backend if options.watch
+                          else linear_constraints.backend)
+    if 1 < options.solve_jobs and options.solver == 'incremental':
+        # (It solves as the equations go in, leaving nothing to farm out.)
+        argparser.error("--solve-jobs needs a batch --solver,"
+                        " python or numpy")
+    return options
+
+def configure(solver, lin_exps, solve_jobs=1):
+    linear_constraints.use_backend(solver)
+    linear_constraints.use_lin_exps(lin_exps)
+    linear_constraints.use_solve_jobs(solve_jobs)
+
+def parse_files(filenames, cache_dir):
+    "Return the files' definitions, or None after reporting a syntax error."
     defs = []
-    for filename in argv[1:]:
-        with open(filename) as f:
-            text = f.read()
+    for filename in filenames:
         try:
-            defs.extend(parser.parse(text))
+            defs.extend(parse_cache.parse_file(filename, cache_dir))
         except parser.Unparsable as e:
-            syntax_error(e, filename)
+            sys.stderr.write(syntax_error(e, filename))
+            return None
+    return defs
+
+
+# Batch mode: each input file is a program, to render on its own, in
+# a pool of worker processes that share the already-parsed library.
+
+def batch(options, library, cache_dir):
+    start = time.time()
+    jobs = [(filename, output_name(filename, options), cache_dir)
+            for filename in options.filenames]
+    written_by = {}             # output filename -> input filename
+    for filename, output, _ in jobs:
+        if output in written_by:
+            sys.stderr.write('%s and %s would both be written to %s\n'
+                             % (written_by[output], filename, output))
             return 1
-    interpreter.run(defs)
+        written_by[output] = filename
+    init_args = (library, options.solver, options.lin_exps)
+    pool = None
+    if options.jobs <= 1 or len(jobs) <= 1:
+        init_worker(*init_args)
+        results = map(render_job, jobs)
+    else:
+        pool = multiprocessing.Pool(options.jobs, init_worker, init_args)
+        results = pool.imap_unordered(render_job, jobs)
+    failures, busy = 0, 0.
+    for filename, error, times in results:
+        busy += sum(times.values())
+        if error:
+            failures += 1
+            sys.stderr.write('%s: FAILED\n%s' % (filename, error))
+        else:
+            sys.stderr.write('%s: %s\n' % (filename, format_times(times)))
+    sys.stderr.write('%d rendered, %d failed, in %.3fs (%.3fs in jobs)\n'
+                     % (len(jobs) - failures, failures,
+                        time.time() - start, busy))
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return 1 if failures else 0
+
+def output_name(filename, options):
+    base = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(options.out_dir,
+                        base + ('.svgz' if options.svgz else '.svg'))
+
+worker_library = None
+
+def init_worker(library, solver, lin_exps):
+    global worker_library
+    worker_library = library
+    configure(solver, lin_exps) # (Pool workers can't have their own pools.)
+
+def render_job((filename, output, cache_dir)):
+    "Render one file; return (filename, error message or None, times)."
+    times = {}
+    try:
+        start = time.time()
+        defs = parse_cache.parse_file(filename, cache_dir)
+        times['parse'], start = time.time() - start, time.time()
+        canvas = interpreter.run(worker_library + defs)
+        times['render'], start = time.time() - start, time.time()
+        canvas.save(output)
+        times['write'] = time.time() - start
+        return filename, None, times
+    except parser.Unparsable as e:
+        return filename, syntax_error(e, filename), times
+    except Exception:
+        return filename, traceback.format_exc(), times
+
+def format_times(times):
+    return ' '.join('%s %.3fs' % (phase, times[phase])
+                    for phase in ('parse', 'render', 'write'))
+
+
+# Watch mode: poll the files, and on a change, reparse just the
+# changed files and rerun. Definitions that come out the same as
+# before are kept, with their compiled templates, and so are the
+# solutions to components whose equations come out the same -- but
+# only with a batch solver, since the incremental one has already
+# done the solving as the equations went in. So that's the default.
+
+poll_interval = 0.25            # Seconds between checks for changes.
+watch_backend = 'python'        # --watch's default --solver.
+
+def watch(options, cache_dir):
+    session = Session(options.libs + options.filenames, cache_dir)
+    try:
+        while True:
+            start = time.time()
+            changed = session.update()
+            if changed:
+                status = session.redraw(options.output)
+                sys.stderr.write('%s: %s in %.3fs\n'
+                                 % (', '.join(changed), status,
+                                    time.time() - start))
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        pass
+
+class Session(object):
+    "A program spread over files, kept up to date with them."
+    def __init__(self, filenames, cache_dir):
+        self.filenames = filenames
+        self.cache_dir = cache_dir
+        self.mtimes = {}        # filename -> its mtime when last parsed
+        self.parsed = {}        # filename -> its parsed contents
+        self.broken = set()     # filenames that didn't parse
+        self.types = {}         # The type registry, reused across runs,
+        self.solutions = {}     # and the solved components.
+    def update(self):
+        "Reparse the files changed since last time; return their names."
+        changed = []
+        for filename in self.filenames:
+            try:
+                mtime = os.stat(filename).st_mtime
+            except OSError:
+                continue        # Maybe mid-save; look again next time.
+            if self.mtimes.get(filename) != mtime:
+                self.mtimes[filename] = mtime
+                changed.append(filename)
+        changed_ids = set()
+        for filename in changed:
+            try:
+                defs = parse_cache.parse_file(filename, self.cache_dir)
+            except parser.Unparsable as e:
+                sys.stderr.write(syntax_error(e, filename))
+                self.broken.add(filename)
+                continue
+            self.broken.discard(filename)
+            defs, ids = carry_over(self.parsed.get(filename, []), defs)
+            self.parsed[filename] = defs
+            changed_ids |= ids
+        interpreter.invalidate(self.program(), changed_ids)
+        return changed
+    def program(self):
+        return [item for filename in self.filenames
+                for item in self.parsed.get(filename, [])]
+    def redraw(self, output):
+        "Rerun the program, unless it's broken; return how that went."
+        if self.broken:
+            return 'not redrawn'
+        try:
+            canvas = interpreter.run(self.program(), types=self.types,
+                                     solutions=self.solutions)
+        except Exception:
+            sys.stderr.write(traceback.format_exc())
+            return 'failed'
+        if output == '-':
+            canvas.write(sys.stdout)
+            sys.stdout.flush()
+        else:
+            canvas.save(output)
+        return 'redrawn'
+
+def carry_over(old_defs, new_defs):
+    """Return new_defs with each Definition structurally the same as
+    one in old_defs replaced by that old one; and the ids of the
+    Definitions not carried over, from either list."""
+    old_by_structure = {repr(item): item for item in old_defs
+                        if isinstance(item, interpreter.Definition)}
+    defs, changed_ids = [], set()
+    for item in new_defs:
+        if isinstance(item, interpreter.Definition):
+            old = old_by_structure.pop(repr(item), None)
+            if old is None:
+                changed_ids.add(item.id)
+            else:
+                item = old
+        defs.append(item)
+    changed_ids.update(item.id for item in old_by_structure.itervalues())
+    return defs, changed_ids
+
+
+# Server mode: stay up with the grammar and library loaded, and
+# render each program sent to us. A request is a line of JSON like
+# {"id": 1, "source": "..."}; the reply, a line like {"id": 1, "svg":
+# "...", "time": 0.003} or with "error" instead of "svg". Every
+# request gets a fresh type registry, so requests can't affect each
+# other's definitions.
+
+def serve(library, infile, outfile):
+    "Answer requests from infile on outfile until end of file."
+    for line in iter(infile.readline, ''):
+        if line.strip():
+            outfile.write(json.dumps(respond(library, line)) + '\n')
+            outfile.flush()
+
+def respond(library, line):
+    start = time.time()
+    request = None
+    try:
+        request = json.loads(line)
+        source = request['source'].encode('utf-8')
+    except (ValueError, TypeError, KeyError, AttributeError):
+        reply = dict(error="Bad request: %r\n" % line)
+        if isinstance(request, dict) and 'id' in request:
+            reply['id'] = request['id']
+        return reply
+    reply = dict(id=request.get('id'))
+    if instrument.enabled:
+        instrument.reset()
+    try:
+        canvas = interpreter.run(library + parser.parse(source))
+        reply['svg'] = canvas.to_string()
+    except parser.Unparsable as e:
+        reply['error'] = syntax_error(e, request.get('filename', '<request>'))
+    except Exception:
+        reply['error'] = traceback.format_exc()
+    reply['time'] = time.time() - start
+    if instrument.enabled:
+        reply['stats'] = instrument.report()
+    return reply
+
+def serve_socket(library, path):
+    """Serve connections to a Unix socket at path, each in a process
+    of its own (forked, so sharing the parsed library), since a run's
+    state lives in module globals."""
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        if is_live(path):
+            sys.stderr.write('%s: a server is already listening there\n'
+                             % path)
+            return 1
+        os.unlink(path)         # Left over from a server that died.
+    server = Server(path, RequestHandler)
+    server.library = library
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
     return 0
 
+def is_live(path):
+    "Does something accept connections on the Unix socket at path?"
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error as e:
+        return e.errno != errno.ECONNREFUSED
+    finally:
+        sock.close()
+    return True
+
+class Server(SocketServer.ForkingMixIn, SocketServer.UnixStreamServer):
+    def handle_error(self, request, client_address):
+        if sys.exc_info()[0] is KeyboardInterrupt:
+            raise               # (SocketServer would swallow it.)
+        SocketServer.UnixStreamServer.handle_error(self, request,
+                                                   client_address)
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    "Answers requests; a client that hangs up first gets no answer."
+    def handle(self):
+        try:
+            serve(self.server.library, self.rfile, self.wfile)
+        except IOError:         # (socket.error is one.)
+            pass
+    def finish(self):
+        try:
+            SocketServer.StreamRequestHandler.finish(self)
+        except IOError:         # (Flushing what it couldn't send before.)
+            pass
+
+
 def syntax_error(e, filename):
+    "Return a message locating the error."
     line_no, prefix, suffix = where(e)
     prefix, suffix = sanitize(prefix), sanitize(suffix)
-    sys.stderr.write("%s:%d:%d: Syntax error\n" % (filename, line_no, len(prefix)))
-    sys.stderr.write('  ' + prefix + suffix + '\n')
-    sys.stderr.write('  ' + ' '*len(prefix) + '^\n')
+    return ("%s:%d:%d: Syntax error\n" % (filename, line_no, len(prefix))
+            + '  ' + prefix + suffix + '\n'
+            + '  ' + ' '*len(prefix) + '^\n')
 
 def where(e):
     before, after = e.failure
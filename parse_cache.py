@@ -0,0 +1,86 @@
+"""
+Cache parsed Linogram source on disk, keyed by a hash of the text
+(and of the code that parses it), so unchanged files such as shared
+definition libraries needn't go through the grammar again.
+
+Loading a pickle can run arbitrary code, so the cache is opt-in, and
+a cache directory gets used only if it's ours and no one else can
+write to it.
+"""
+
+import cPickle as pickle
+import hashlib, os, stat, tempfile
+
+import instrument, interpreter, linear_constraints, parser, structs
+
+def default_dir():
+    "The cache directory named by the environment, or None for no cache."
+    return os.environ.get('MINILINOGRAM_CACHE') or None
+
+def parse_file(filename, cache_dir=None):
+    "Return the parsed contents of a file, using cache_dir if not None."
+    with open(filename) as f:
+        text = f.read()
+    return parse(text, cache_dir)
+
+def parse(text, cache_dir=None):
+    if cache_dir is None or not trusted(cache_dir):
+        return parser.parse(text)
+    path = os.path.join(cache_dir, key(text) + '.pickle')
+    try:
+        with open(path, 'rb') as f:
+            defs = pickle.load(f)
+        if instrument.enabled: instrument.count('parse cache hits')
+        return defs
+    except Exception:           # Missing, or unreadable: parse afresh.
+        pass
+    defs = parser.parse(text)
+    save(path, defs)
+    return defs
+
+def key(text):
+    return hashlib.sha1(code_version() + text).hexdigest()
+
+_code_version = None
+
+def code_version():
+    "A hash of the modules that determine what parsing produces."
+    global _code_version
+    if _code_version is None:
+        h = hashlib.sha1()
+        for module in (parser, interpreter, linear_constraints, structs):
+            with open(os.path.splitext(module.__file__)[0] + '.py') as f:
+                h.update(f.read())
+        _code_version = h.hexdigest()
+    return _code_version
+
+def trusted(cache_dir):
+    """Is cache_dir owned by us and unwritable by anyone else? (If it
+    doesn't exist yet, save will make it so.)"""
+    try:
+        st = os.stat(cache_dir)
+    except OSError:
+        return not os.path.exists(cache_dir)
+    return (st.st_uid == os.getuid()
+            and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+def save(path, defs):
+    "Write atomically, so a concurrent reader never sees a partial file."
+    directory = os.path.dirname(path)
+    temp_path = None
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(defs, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, path)
+        temp_path = None
+    except (IOError, OSError, pickle.PicklingError, TypeError, RuntimeError):
+        pass                    # Caching is just an optimization.
+    finally:
+        if temp_path is not None:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
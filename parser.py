@@ -7,7 +7,7 @@ which is copyright by Mark Jason Dominus.
 """
 
 from parson import Grammar, Unparsable
-import interpreter
+import instrument, interpreter
 
 grammar = Grammar(r""" (definition | declaration)* ('__END__' | :end).
 
@@ -19,10 +19,14 @@ declaration: ID declarators ';'   :VarDecl
            | draw_section.
 
 declarators: declarator++','   :hug.
-declarator: ID [('(' param_spec++',' ')')? :hug]   :Declarator.
+declarator: ID '[' NUMBER ']' params   :ArrayDeclarator
+          | ID params                  :Declarator.
+params: [('(' param_spec++',' ')')? :hug].
 param_spec: ID '=' expression   :hug.
 
-constraint_section: "constraints" '{' constraint* '}'   :hug :Constraints.
+constraint_section: "constraints" '{' constraint* '}'   :hug :Constraints
+                  | "constraints" "for" ID '=' expression "to" expression
+                    '{' [constraint* :hug] '}'         :ConstraintLoop.
 constraint: expression '=' expression ';' :hug.
 
 draw_section: "draw" '{' drawable* '}'   :hug :Draw.
@@ -40,7 +44,8 @@ atom: name
     | '-' expression   :Negate
     | '(' expression ')'.
 
-name: ID :Name ('.' ID :Dot)*.
+name: ID :Name ('.' ID :Dot
+               |'[' expression ']' :Index)*.
 
 tuple: '(' expression (',' expression)+ ')'   :hug :Tuple.
 
@@ -55,4 +60,9 @@ mantissa ~:  /\d+/ ('.' /\d*/)?
 
 FNORD    ~:  /\s*/.
 """)
-parse = grammar.bind(interpreter)
+parse_program = grammar.bind(interpreter)
+
+def parse(text):
+    "Return the definitions and declarations in text, constant-folded."
+    with instrument.timing('parse'):
+        return interpreter.fold(parse_program(text))
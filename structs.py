@@ -2,11 +2,15 @@
 Define a named-tuple-like type, but simpler.
 """
 
-# TODO figure out how to use __slots__
+import sys
 
 def Struct(field_names, name=None, supertype=(object,)):
+    """Make a class with the given fields in __slots__ and an __init__
+    taking them positionally, their names listed in _fields. (Subclasses
+    should say __slots__ = () to stay free of a __dict__.)"""
     if isinstance(field_names, (str, unicode)):
         field_names = tuple(field_names.split())
+    field_names = tuple(field_names)
 
     if name is None:
         name = 'Struct<%s>' % ','.join(field_names)
@@ -14,11 +18,7 @@ def Struct(field_names, name=None, supertype=(object,)):
     else:
         def get_name(self): return name
 
-    def __init__(self, *args):
-        if len(field_names) != len(args):
-	    raise TypeError("%s takes %d arguments (%d given)"
-                            % (get_name(self), len(field_names), len(args)))
-        self.__dict__.update(zip(field_names, args))
+    __init__ = make_init(field_names, get_name)
 
     def __repr__(self):
         return '%s(%s)' % (get_name(self), ', '.join(repr(getattr(self, f))
@@ -32,9 +32,36 @@ def Struct(field_names, name=None, supertype=(object,)):
 
     return type(name,
                 supertype,
-                dict(__init__=__init__,
+                dict(__slots__=field_names,
+                     _fields=field_names,
+                     __init__=__init__,
                      __repr__=__repr__,
-                     as_sexpr=my_as_sexpr))
+                     as_sexpr=my_as_sexpr,
+                     # So that pickle can find a named Struct:
+                     __module__=sys._getframe(1).f_globals.get('__name__')))
+
+def make_init(field_names, get_name):
+    """Compile an __init__ specialized to field_names. (The fields
+    default to `missing` just so a wrong number of arguments gets our
+    own error, naming the struct.)"""
+    fields = ', '.join(field_names)
+    source = ('def __init__(self, %s*extra):\n'
+              '    if extra%s:\n'
+              '        given = len(extra) + sum(arg is not missing\n'
+              '                                 for arg in (%s))\n'
+              '        raise TypeError("%%s takes %%d arguments (%%d given)"\n'
+              '                        %% (get_name(self), %d, given))\n'
+              '%s'
+              % (''.join(f + '=missing, ' for f in field_names),
+                 ' or %s is missing' % field_names[-1] if field_names else '',
+                 fields + ',' if field_names else '',
+                 len(field_names),
+                 ''.join('    self.%s = %s\n' % (f, f) for f in field_names)))
+    namespace = dict(get_name=get_name, missing=missing)
+    exec source in namespace
+    return namespace['__init__']
+
+missing = object()              # The default of every field, to catch.
 
 def as_sexpr(obj):
     if hasattr(obj, 'as_sexpr'):
@@ -0,0 +1,82 @@
+"""
+Render drawings as SVG, into memory first: then we know the bounding
+box for the viewBox, and can write the whole document to any
+file-like object in a few big writes, optionally gzipped (.svgz).
+"""
+
+import gzip
+from cStringIO import StringIO
+
+class Canvas(object):
+    "Collects shapes, in figure coordinates, to write out as SVG."
+    def __init__(self, xscale=40, yscale=40, margin=10):
+        self.xscale, self.yscale = xscale, yscale
+        self.margin = margin
+        self.elements = []      # Formatted SVG elements, or coordinates.
+        self.pending = []       # Indices in elements of unformatted polylines.
+        self.bounds = None      # (xmin, ymin, xmax, ymax) in SVG units.
+    def polyline(self, points):
+        coords = []             # Alternating x and y, in SVG units.
+        for x, y in points:
+            coords.append(x*self.xscale)
+            coords.append(y*self.yscale)
+        self.pending.append(len(self.elements))
+        self.elements.append(coords)
+    def comment(self, text):
+        self.elements.append('<!-- %s -->\n' % text.replace('--', '- -'))
+    def format_pending(self):
+        """Format the polylines drawn since last time, all together:
+        there are many fewer distinct coordinates than uses of them."""
+        polylines = [self.elements[i] for i in self.pending]
+        xs = [x for coords in polylines for x in coords[0::2]]
+        ys = [y for coords in polylines for y in coords[1::2]]
+        if xs:
+            self.include(xs, ys)
+        strs = {num: coord_str(num) for num in set(xs) | set(ys)}
+        for i, coords in zip(self.pending, polylines):
+            cs = [strs[num] for num in coords]
+            self.elements[i] = (
+                '<polyline points="%s" fill="transparent" stroke="black" stroke-width="1"/>\n'
+                % ', '.join([x + ' ' + y for x, y in zip(cs[0::2], cs[1::2])]))
+        self.pending = []
+    def include(self, xs, ys):
+        if self.bounds is not None:
+            xmin, ymin, xmax, ymax = self.bounds
+            xs = xs + [xmin, xmax]
+            ys = ys + [ymin, ymax]
+        self.bounds = min(xs), min(ys), max(xs), max(ys)
+    def view_box(self):
+        "Return (x, y, width, height) around all that's drawn."
+        self.format_pending()
+        xmin, ymin, xmax, ymax = self.bounds or (0, 0, 0, 0)
+        m = self.margin
+        # (Offset by half a pixel so 1-wide lines on integers are crisp.)
+        return (xmin - m - .5, ymin - m - .5,
+                xmax - xmin + 2*m, ymax - ymin + 2*m)
+    def write(self, f, compress=False, chunk_size=1000):
+        "Write the document to file-like f, gzipped if compress."
+        if compress:
+            f = gzip.GzipFile(fileobj=f, mode='wb', mtime=0)
+        x, y, width, height = map(coord_str, self.view_box())
+        f.write('<svg version="1.1" baseProfile="full" xmlns="http://www.w3.org/2000/svg"\n'
+                '    width="%s" height="%s" viewBox="%s %s %s %s">\n'
+                % (width, height, x, y, width, height))
+        for i in xrange(0, len(self.elements), chunk_size):
+            f.write(''.join(self.elements[i:i+chunk_size]))
+        f.write('</svg>\n')
+        if compress:
+            f.close()           # (Flushes the gzip trailer; f's file stays open.)
+    def save(self, filename):
+        "Write to filename, gzipped if it ends in .svgz."
+        with open(filename, 'wb') as f:
+            self.write(f, compress=filename.endswith('.svgz'))
+    def to_string(self, compress=False):
+        f = StringIO()
+        self.write(f, compress)
+        return f.getvalue()
+
+def coord_str(num):
+    s = '%g' % round(num, 1)
+    # Sometimes we get varying '-0' or '0' from run to run. Hide the
+    # variation:
+    return '0' if s == '-0' else s
@@ -0,0 +1,140 @@
+"""
+Smoke test for boolean_constraints.
+"""
+
+import time
+
+import boolean_constraints as bc
+from constraints import Variable
+
+
+def values(variables):
+    return ' '.join('T' if v.get_value() else
+                    'F' if v.get_value() is not None else '?'
+                    for v in variables)
+
+# A half adder with its inputs pinned down.
+a, b, s, c = Variable(), Variable(), Variable(), Variable()
+bc.relate([a, b, s], lambda a, b, s: s == (a != b))
+bc.relate([a, b, c], lambda a, b, c: c == (a and b))
+bc.relate([a], lambda a: a)
+bc.relate([b], lambda b: b)
+print values([a, b, s, c])
+
+# Run it backwards: a sum of 1 with no carry means exactly one input.
+a, b, s, c = Variable(), Variable(), Variable(), Variable()
+bc.relate([a, b, s], lambda a, b, s: s == (a != b))
+bc.relate([a, b, c], lambda a, b, c: c == (a and b))
+bc.relate([s, c], lambda s, c: s and not c)
+bc.relate([b], lambda b: not b)
+print values([a, b, s, c])
+
+# The variables' order doesn't matter to relate().
+p, q = Variable(), Variable()
+bc.relate([q, p], lambda q, p: q and not p)
+print values([p, q])
+
+# A value assigned before solving is respected.
+x, y = Variable(), Variable()
+x.assign(False)
+bc.relate([x, y], lambda x, y: x or y)
+print values([x, y])
+
+# Three pigeons won't fit in two holes; nothing gets assigned.
+holes = [[Variable() for _ in range(2)] for _ in range(3)]
+for pigeon in holes:
+    bc.relate(pigeon, lambda h0, h1: h0 or h1)
+for h in range(2):
+    for i in range(3):
+        for j in range(i+1, 3):
+            bc.relate([holes[i][h], holes[j][h]], lambda u, v: not (u and v))
+print values(holes[0])
+
+# A ring of 300 variables alternating around, plus 100 unrelated
+# pairs, which get solved as separate parts.
+ring = [Variable() for _ in range(300)]
+for u, v in zip(ring, ring[1:] + ring[:1]):
+    bc.relate([u, v], lambda u, v: u != v)
+bc.relate([ring[0]], lambda u: u)
+pairs = [(Variable(), Variable()) for _ in range(100)]
+for u, v in pairs:
+    bc.relate([u, v], lambda u, v: u == v)
+anchor = Variable()
+for u, v in pairs:
+    bc.relate([anchor, u], lambda anchor, u: anchor or u)
+start = time.time()
+print values(ring[:6]), values(ring[-2:])
+print values(sum(pairs[:3], ())), values([anchor])
+print time.time() - start < 5
+
+# An odd ring can't alternate.
+ring = [Variable() for _ in range(301)]
+for u, v in zip(ring, ring[1:] + ring[:1]):
+    bc.relate([u, v], lambda u, v: u != v)
+print values(ring[:3])
+
+# A loop of implications makes all its variables equal, without
+# saying to what: one guess, and propagation settles the rest.
+chain = [Variable() for _ in range(200)]
+for u, v in zip(chain, chain[1:]):
+    bc.relate([u, v], lambda u, v: not u or v)
+bc.relate([chain[0], chain[-1]], lambda u, v: u or not v)
+print values(chain[:3]), values(chain[-3:])
+
+# Compiled to a decision diagram, a network can count and list its
+# solutions, and check partial assignments.
+a, b, s, c = Variable(), Variable(), Variable(), Variable()
+bc.relate([a, b, s], lambda a, b, s: s == (a != b))
+adder = bc.relate([a, b, c], lambda a, b, c: c == (a and b))
+d = adder.compile()
+print d.count(), d.count({s: True}), d.satisfiable({s: True, c: True})
+def bits(model, variables):
+    return ''.join('1' if model[v] else '0' for v in variables)
+for model in d.models():
+    print bits(model, [a, b]), '->', bits(model, [c, s])
+
+def queens(n):
+    "The n-queens puzzle, with a variable per square."
+    board = [[Variable() for _ in range(n)] for _ in range(n)]
+    for row in board:
+        bc.relate(row, lambda *squares: sum(squares) == 1)
+    squares = [(i, j) for i in range(n) for j in range(n)]
+    for k, (i, j) in enumerate(squares):
+        for i2, j2 in squares[k+1:]:
+            if i != i2 and (j == j2 or abs(i - i2) == abs(j - j2)):
+                bc.relate([board[i][j], board[i2][j2]],
+                          lambda u, v: not (u and v))
+    return board
+
+board = queens(6)
+d = next(iter(board[0][0].constraints)).compile()
+print d.count(), d.count({board[0][1]: True}), d.satisfiable({board[0][0]: True})
+print [[j for i in range(6) for j in range(6) if model[board[i][j]]]
+       for model in d.models()]
+
+# Walking a diagram doesn't recurse once per level, so a long chain
+# of implications compiles and counts fine.
+chain = [Variable() for _ in range(2000)]
+for u, v in zip(chain, chain[1:]):
+    bc.relate([u, v], lambda u, v: not u or v)
+d = next(iter(chain[0].constraints)).compile()
+print d.count(), d.satisfiable({chain[0]: True, chain[-1]: False})
+
+#. T T F T
+#. T F T F
+#. F T
+#. F T
+#. ? ?
+#. T F T F T F T F
+#. T T T T T T F
+#. True
+#. ? ? ?
+#. T T T T T T
+#. 4 2 False
+#. 00 -> 00
+#. 01 -> 01
+#. 10 -> 01
+#. 11 -> 10
+#. 4 1 False
+#. [[2, 5, 1, 4, 0, 3], [1, 3, 5, 0, 2, 4], [4, 2, 0, 5, 3, 1], [3, 0, 4, 1, 5, 2]]
+#. 2001 False
@@ -2,7 +2,9 @@
 Smoke test for linear_constraints.
 """
 
+import instrument
 import linear_constraints as lc
+import linear_equations
 
 
 x = lc.Number()
@@ -45,3 +47,103 @@ lc.zero(l1.end.y - (l1.start.y + 10))
 lc.zero(l1.start - dict(x=3, y=4))
 
 l1.draw()
+
+
+# Coupled equations go to the solver; what they determine then
+# settles later one-variable equations without it.
+a, b, c = lc.Number(), lc.Number(), lc.Number()
+lc.zero(a + b - 10)
+lc.zero(a - b - 2)
+print a.get_value(), b.get_value()
+lc.zero(c - a - 1)
+print c.get_value()
+
+# A variable already in a solved system, pinned afterward.
+u, v = lc.Number(), lc.Number()
+lc.zero(u - v)
+print u.get_value()
+lc.zero(v - 2)
+print u.get_value()
+
+# Aliases: p is q + 1, r is 4 - q, and then p - r = 1 pins down q.
+p, q, r = lc.Number(), lc.Number(), lc.Number()
+lc.zero(p - q - 1)
+lc.zero(q + r - 4)
+lc.zero(p - r - 1)
+print p.get_value(), q.get_value(), r.get_value()
+s, t = lc.Number(), lc.Number()
+lc.zero(s - t - 1)
+print s.get_value(), t.get_value()
+# Aliases that disagree contradict each other, so pinning their
+# representative afterward settles nothing.
+for backend in ['incremental', 'python']:
+    lc.use_backend(backend)
+    p, q = lc.Number(), lc.Number()
+    lc.zero(p - q - 1)
+    lc.zero(p - q - 2)
+    lc.zero(q - 5)
+    print p.get_value(), q.get_value()
+lc.use_backend('incremental')
+
+# Frozen once solved, a network keeps its values, determined or not,
+# while its variables no longer refer back to it.
+f, g, h, k = lc.Number(), lc.Number(), lc.Number(), lc.Number()
+_, constraints = lc.collect(lambda: [lc.zero(f + g - 3), lc.zero(f - g - 1),
+                                     lc.zero(h - k - 1)])
+lc.solve_all(constraints)
+lc.freeze(constraints)
+print f.get_value(), g.get_value(), h.get_value(), k.get_value()
+print f.lin_exp.a_variable().constraints is lc.frozen
+
+# A contradiction leaves its whole component undetermined, even the
+# variables presolving had already given values.
+for backend in ['incremental', 'python']:
+    lc.use_backend(backend)
+    x, y = lc.Number(), lc.Number()
+    lc.zero(x - 1)
+    lc.zero(y - x - 3)
+    lc.zero(x - 2)
+    print x.get_value(), y.get_value()
+lc.use_backend('incremental')
+
+# With a batch backend, solve_all leaves a component's solution in a
+# reuse dict, for the next run with the same equations (up to renaming
+# the variables) to take instead of solving.
+def triple():
+    a, b, c = lc.Number(), lc.Number(), lc.Number()
+    lc.zero(a + b + c - 6)
+    lc.zero(a - b + c - 2)
+    lc.zero(a + b - c)
+    return a, b, c
+lc.use_backend('python')
+reuse = {}
+instrument.enable()
+for run in range(2):
+    numbers, constraints = lc.collect(triple)
+    lc.solve_all(constraints, reuse)
+    print [n.get_value() for n in numbers],
+    print instrument.counts.get('reused components')
+instrument.disable()
+lc.use_backend('incremental')
+
+# The numpy backend solves a big enough system densely, but leaves
+# one too big for a dense matrix to the Python solver. (Needs NumPy.)
+if linear_equations.numpy is not None:
+    chain = [linear_equations.LinExp(-1, [('x0', 1)])]
+    for k in range(1, 100):
+        chain.append(linear_equations.LinExp(-1, [('x%d' % k, 1),
+                                                  ('x%d' % (k-1), -1)]))
+    saved_limit = linear_equations.numpy_limit
+    instrument.enable()
+    for limit in [1000, 10]:
+        linear_equations.numpy_limit = limit
+        solution = linear_equations.numpy_solve_equations(chain)
+        print round(solution['x99'], 6), instrument.counts.get('numpy solves')
+    instrument.disable()
+    linear_equations.numpy_limit = saved_limit
+
+# Frozen variables left undetermined can't take on new constraints.
+try:
+    lc.zero(h + k - 5)
+except AssertionError as e:
+    print str(e).split(': ')[1]